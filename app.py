@@ -1,19 +1,22 @@
 #!/usr/bin/env python
 import datetime
-import random
+import os
+import sys
 import time
-import urllib.error
-import urllib.parse
-import urllib.request
-from collections import deque
 
 import tornado.escape
 import tornado.gen
+import tornado.httpclient
+import tornado.httpserver
 import tornado.ioloop
+import tornado.iostream
+import tornado.locks
+import tornado.netutil
+import tornado.options
 import tornado.platform.twisted
+import tornado.process
 import tornado.web
 import tornado.websocket
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest
 
 # install this before importing anything else, or VERY BAD THINGS happen
 tornado.platform.twisted.install()
@@ -29,73 +32,130 @@ from couchbase.options import ClusterOptions
 from couchbase.diagnostics import ServiceType
 from couchbase.options import WaitUntilReadyOptions
 
+import broadcast
+import catalog
 import cb_status
+import db
+import fts_client
+import geo
+import holdings
+import leaderboard
+import loop_monitor
+import metrics
+import order_writer
+import orders
+import price_board
+import price_feed
+import price_history
+import queries
+import search
 import settings
+import workers
 
-socket_list = []
 bucket_name = settings.BUCKET_NAME
 user = settings.USERNAME
 password = settings.PASSWORD
 node = settings.CLUSTER_NODES[0]
 
-# Connect options - authentication
-auth = PasswordAuthenticator(
-    user,
-    password,
+# Parsed separately from tornado.options.options, so the benchmarks can import
+# this module alongside their own options
+options = tornado.options.OptionParser()
+options.define("role", default="", help='"worker" for a web worker process')
+options.define(
+    "channel", default=settings.WORKER_CHANNEL, help="socket the ingester listens on"
 )
-# Get a reference to our cluster
-# NOTE: For TLS/SSL connection use 'couchbases://<your-ip-address>' instead
-cluster = Cluster(f"couchbase://{node}", ClusterOptions(auth))
-
-# Wait until the cluster is ready for use.
-cluster.wait_until_ready(
-    timedelta(seconds=3),
-    WaitUntilReadyOptions(service_types=[ServiceType.KeyValue, ServiceType.Query]),
-)
-
-# cluster.wait_until_ready(timedelta(seconds=5))
+options.define("origin", default="", help="origin to tag submitted orders with")
 
-default_collection = cluster.bucket(bucket_name).default_collection()
+# Set by connect()
+cluster = None
+default_collection = None
+data_access = db.DataAccess(None, None)
+prices = None
+# Set by start_ingest() when this process writes the price board
+board = None
 
-fts_nodes = None
-fts_enabled = False
-nodes = []
-n1ql_enabled = False
-xdcr_enabled = False
 price_data = {}
-portfolio_cache = []
+portfolio_cache = orders.OrderLog()
+price_broadcaster = broadcast.PriceBroadcaster(price_data)
+investor_leaderboard = leaderboard.Leaderboard(
+    5, key=lambda portfolio: portfolio["current_value"]
+)
+portfolio_holdings = holdings.Holdings(price_data, portfolio_cache)
+stock_performance = {}
+# Set when prices moved since the portfolios were last valued
+revalue_pending = False
+geo_aggregates = geo.GeoAggregates(portfolio_holdings)
+history = price_history.PriceHistory()
+stock_catalog = catalog.Catalog()
+search_cache = search.ResultCache()
+profiler = loop_monitor.Profiler()
+fts = fts_client.FTSClient()
+cluster_status = cb_status.ClusterStatus()
+stock_leaderboard = leaderboard.Leaderboard(
+    10, key=lambda stock: stock["price_diff"], worst_first=True
+)
+
+# One timer per topic, however many sockets are listening
+order_feed = orders.OrderFeed(portfolio_cache)
+order_queue = order_writer.OrderWriter(data_access)
+hub = broadcast.Hub()
+hub.topic("status", source=cluster_status.payload)
+hub.topic(
+    "orders",
+    source=order_feed.next,
+    interval=settings.ORDERS_TICK,
+    depth=settings.WS_ORDERS_QUEUE,
+)
+hub.topic(
+    "stocks", source=stock_leaderboard.payload, interval=settings.LEADERBOARD_TICK
+)
+hub.topic(
+    "investors", source=investor_leaderboard.payload, interval=settings.LEADERBOARD_TICK
+)
+hub.add("prices", price_broadcaster)
+# Only web workers follow these, to keep their copies of what the ingester
+# knows up to date
+hub.topic("cluster", source=lambda: broadcast.encode(cluster_status.snapshot))
+hub.topic("catalog", source=lambda: broadcast.encode(stock_catalog.cas))
+# What the ingester sends each web worker
+RELAYED = ("prices", "orders", "stocks", "investors", "cluster", "catalog")
+# A web worker's connection to the ingester
+channel = None
+
+# Orders read from the bucket per tick
+ORDER_PAGE = 50
+
+TICK_SECONDS = metrics.Histogram(
+    "cbex_tick_seconds", "Time each stage of a price data tick takes", ["stage"]
+)
+ORDER_LAG = metrics.Histogram(
+    "cbex_order_ingest_lag_seconds",
+    "Time from an order being placed to it reaching the order log, by source",
+    ["source"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+# When update_price_data last finished a tick
+last_tick = time.time()
+metrics.Collected(
+    "cbex_tick_age_seconds",
+    "Seconds since update_price_data last finished a tick",
+    [],
+    lambda: {(): time.time() - last_tick},
+)
+metrics.Collected(
+    "cbex_order_queue_length",
+    "Orders waiting to be written",
+    [],
+    lambda: {(): order_queue.queue.qsize()},
+)
 
 
 class ExchangeHandler(tornado.web.RequestHandler):
     @tornado.gen.coroutine
     def get(self):
-        company_list = default_collection.get(settings.PRODUCT_LIST)
-        #print(f"company_list: {company_list}")
-        stocks = default_collection.get_multi(company_list.value["symbols"])
-        #print(f"stocks: {stocks}")
-        result = cluster.query(
-            "SELECT distinct sector from {} where sector IS NOT MISSING".format(
-                bucket_name
-            )
-        )
-        sectors = []
-        for row in result.rows():
-            sectors.append(row["sector"])
-        sectors = sorted(sectors)
-
-        first_keys = []
-        rest = []
-        for stock, stock_doc in stocks.results.items():
-            if stock_doc.value["priority"] == 1:
-                first_keys.append(stock)
-            else:
-                rest.append(stock)
-        random.shuffle(first_keys)
-        random.shuffle(rest)
-        keys = first_keys + rest
-        self.render(
-            "www/exchange.html", stocks=stocks.results, keys=keys, sectors=sectors
-        )
+        if not stock_catalog.loaded:
+            yield load_catalog()
+        self.write(stock_catalog.render_page(self))
 
 
 class LatestOrdersHandler(tornado.web.RequestHandler):
@@ -116,32 +176,22 @@ class InvestorLeaderboardHandler(tornado.web.RequestHandler):
 class GeoLeaderboardHandler(tornado.web.RequestHandler):
     @tornado.gen.coroutine
     def get(self):
-        base_query = "SELECT portfolio.symbol, doc.name, portfolio.purchase_price, portfolio.quantity from {} as doc \
-        UNNEST doc.`order` as portfolio \
-        {} \
-        ORDER BY portfolio.symbol"
-        geo_data = {}
-        for geo in ["USA", "EU", "Unknown"]:
-            if geo == "Unknown":
-                where_clause = "where doc.`type`=='order' AND doc.`geo` IS MISSING"
-            else:
-                where_clause = "where doc.`type`=='order' AND doc.`geo` == '{}'".format(
-                    geo
+        if channel is not None:
+            # Only the ingester sees every order, so a web worker has it
+            # render the page on its admin app
+            response = yield tornado.httpclient.AsyncHTTPClient().fetch(
+                "http://{}:{}/geo".format(
+                    settings.ADMIN_ADDRESS or "127.0.0.1", settings.ADMIN_PORT
                 )
-            query_res = cluster.query(base_query.format(bucket_name, where_clause))
-            investments = []
-            grand_total = 0
-            for row in query_res.rows():
-                profit = (row["quantity"] * price_data[row["symbol"]]["price"]) - 100
-                row["profit"] = round(profit, 2)
-                row["quantity"] = round(row["quantity"], 2)
-                grand_total += profit
-                investments.append(row)
-            if investments:
-                geo_data[geo] = {
-                    "total": round(grand_total, 2),
-                    "investments": investments,
-                }
+            )
+            self.write(response.body)
+            return
+        if geo_aggregates.warm:
+            geo_data = geo_aggregates.geo_data()
+        else:
+            # Orders are still being ingested, so ask for every geo at once
+            rows = yield data_access.execute(queries.GEO)
+            geo_data = geo.group(rows, price_data)
         self.render("www/geo_leaderboard.html", prices=price_data, geo_data=geo_data)
 
 
@@ -150,163 +200,138 @@ class ClusterVisHandler(tornado.web.RequestHandler):
         self.render("www/visualiser.html")
 
 
-class CBStatusWebSocket(tornado.websocket.WebSocketHandler):
+# Base for every websocket route. Clients that offer permessage-deflate get
+# it, and clients that ask for the packed subprotocol get prices packed.
+class WebSocket(tornado.websocket.WebSocketHandler):
+    def get_compression_options(self):
+        if settings.WS_COMPRESSION_LEVEL is None:
+            return None
+        return {"compression_level": settings.WS_COMPRESSION_LEVEL}
+
+    def select_subprotocol(self, subprotocols):
+        if broadcast.PACKED in subprotocols:
+            return broadcast.PACKED
+        return None
+
+
+# Websocket that just follows one hub topic
+class TopicWebSocket(WebSocket):
     def open(self):
-        self.NAME = "CB Status"
-        if self not in socket_list:
-            socket_list.append(self)
-            self.red = 255
-            print(("{} WebSocket opened").format(self.NAME))
-            self.callback = tornado.ioloop.PeriodicCallback(self.get_node_status, 1000)
-            self.callback.start()
-            self.get_node_status()
+        print(("{} WebSocket opened").format(self.NAME))
+        hub[self.TOPIC].subscribe(self)
 
     def on_message(self, message):
         print(("{} received: {}").format(self.NAME, message))
 
     def on_close(self):
         print(("{} WebSocket closed").format(self.NAME))
-        self.callback.stop()
-
-    def get_node_status(self):
-        msg = {
-            "nodes": nodes,
-            "fts": fts_enabled,
-            "n1ql": n1ql_enabled,
-            "xdcr": xdcr_enabled,
-        }
-        self.write_message(msg)
+        hub[self.TOPIC].unsubscribe(self)
 
 
-class LiveOrdersWebSocket(tornado.websocket.WebSocketHandler):
-    def open(self):
-        self.RECENT_ORDERS = deque(maxlen=50)
-        self.NEXT_CUSTOMER = 0
-        self.PORTFOLIO_INDEX = 0
-        self.NAME = "Live Orders"
-        if self not in socket_list:
-            socket_list.append(self)
-            print(("{} WebSocket opened").format(self.NAME))
-            self.callback = tornado.ioloop.PeriodicCallback(self.send_orders, 2000)
-            self.callback.start()
-            self.send_orders()
+class CBStatusWebSocket(TopicWebSocket):
+    NAME = "CB Status"
+    TOPIC = "status"
 
-    def on_message(self, message):
-        print(("{} received: {}").format(self.NAME, message))
 
-    def on_close(self):
-        print(("{} WebSocket closed").format(self.NAME))
-        self.callback.stop()
+class LiveOrdersWebSocket(TopicWebSocket):
+    NAME = "Live Orders"
+    TOPIC = "orders"
 
-    @tornado.gen.coroutine
-    def send_orders(self):
-        if len(portfolio_cache) > self.PORTFOLIO_INDEX:
-            self.RECENT_ORDERS.extendleft(portfolio_cache[self.PORTFOLIO_INDEX :])
-            self.PORTFOLIO_INDEX = len(portfolio_cache)
-
-        if len(self.RECENT_ORDERS) > 0:
-            display_order = self.RECENT_ORDERS.pop()
-            msg = {"name": display_order["name"], "order": display_order["order"]}
-            self.write_message(msg)
-            if (
-                display_order["name"] == "Couchbase Demo Phone"
-                and self.NEXT_CUSTOMER == 0
-            ):
-                self.callback.stop()
-                yield tornado.gen.sleep(2)
-                self.callback.start()
-
-
-class StockLeaderboardWebSocket(tornado.websocket.WebSocketHandler):
-    def open(self):
-        self.NAME = "Stock Leaderboard"
-        if self not in socket_list:
-            socket_list.append(self)
-            print(("{} WebSocket opened").format(self.NAME))
-            self.callback = tornado.ioloop.PeriodicCallback(self.send_leaderboard, 5000)
-            self.callback.start()
-            self.send_leaderboard()
 
-    def on_message(self, message):
-        print(("{} received: {}").format(self.NAME, message))
+class StockLeaderboardWebSocket(TopicWebSocket):
+    NAME = "Stock Leaderboard"
+    TOPIC = "stocks"
 
-    def on_close(self):
-        print(("{} WebSocket closed").format(self.NAME))
-        self.callback.stop()
 
-    @tornado.gen.coroutine
-    def send_leaderboard(self):
-        base_query = "SELECT price_diff,symbol,company,starting_price,price from {} \
-         LET price_diff = 100 * ((price - starting_price))/starting_price \
-         WHERE symbol is not MISSING \
-         ORDER BY price_diff {} \
-         LIMIT 10"
-        try:
-            best_results = cluster.query(base_query.format(bucket_name, "DESC"))
-        except Exception:
-            return
-        good_performers = []
-        for row in best_results.rows():
-            good_performers.append(row)
-        worst_results = cluster.query(base_query.format(bucket_name, ""))
-        poor_performers = []
-        for row in worst_results.rows():
-            poor_performers.append(row)
-        self.write_message({"best": good_performers, "worst": poor_performers})
+class InvestorLeaderboardWebSocket(TopicWebSocket):
+    NAME = "Investor Leaderboard"
+    TOPIC = "investors"
 
 
-class InvestorLeaderboardWebSocket(tornado.websocket.WebSocketHandler):
+class LivePricesWebSocket(WebSocket):
     def open(self):
-        self.NAME = "Investor Leaderboard"
-        if self not in socket_list:
-            socket_list.append(self)
-            print(("{} WebSocket opened").format(self.NAME))
-            self.callback = tornado.ioloop.PeriodicCallback(self.send_leaderboard, 5000)
-            self.callback.start()
-            self.send_leaderboard()
+        self.NAME = "Live Prices"
+        print(("{} WebSocket opened").format(self.NAME))
+        price_broadcaster.subscribe(self, self.selected_subprotocol == broadcast.PACKED)
 
     def on_message(self, message):
-        print(("{} received: {}").format(self.NAME, message))
+        price_broadcaster.receive(self, message)
 
     def on_close(self):
         print(("{} WebSocket closed").format(self.NAME))
-        self.callback.stop()
+        price_broadcaster.unsubscribe(self)
 
-    @tornado.gen.coroutine
-    def send_leaderboard(self):
-        global portfolio_cache
 
-        list_to_sort = [
-            (portfolio["current_value"], portfolio) for portfolio in portfolio_cache
-        ]
-        list_to_sort.sort(key=lambda x: x[0], reverse=True)
+# OHLC bars of one symbol's recent prices, from memory:
+# ?symbol=...&interval=1s|1m|5m, optionally limited to ?start=...&end=...
+# (unix seconds, inclusive)
+class HistoryHandler(tornado.web.RequestHandler):
+    def get(self):
+        symbol = self.get_query_argument("symbol")
+        interval = self.get_query_argument("interval", "1m")
+        if interval not in price_history.INTERVALS:
+            raise tornado.web.HTTPError(400)
+        try:
+            start = float(self.get_query_argument("start", 0))
+            end = float(self.get_query_argument("end", "inf"))
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        bars = history.ohlc(symbol, price_history.INTERVALS[interval], start, end)
+        if bars is None:
+            raise tornado.web.HTTPError(404)
+        self.write(dict(bars, symbol=symbol, interval=interval))
 
-        sorted_portfolios = [portfolio for (key, portfolio) in list_to_sort]
-        best_performers = sorted_portfolios[:5]
-        worst_performers = sorted_portfolios[-5:]
-        self.write_message({"best": best_performers, "worst": worst_performers})
 
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(metrics.render())
 
-class LivePricesWebSocket(tornado.websocket.WebSocketHandler):
-    def open(self):
-        self.NAME = "Live Prices"
-        if self not in socket_list:
-            socket_list.append(self)
-            print(("{} WebSocket opened").format(self.NAME))
-            self.callback = tornado.ioloop.PeriodicCallback(self.send_prices, 5000)
-            self.callback.start()
-            self.send_prices()
 
-    def on_message(self, message):
-        self.write_message(price_data)
+# Samples the event loop (or with all=1, every thread) for `seconds` and
+# answers with the stacks in collapsed form, ready for flamegraph.pl
+class ProfileHandler(tornado.web.RequestHandler):
+    FLAGS = {"": False, "0": False, "false": False, "1": True, "true": True}
 
-    def on_close(self):
-        print(("{} WebSocket closed").format(self.NAME))
-        self.callback.stop()
+    def initialize(self):
+        self.stop_early = tornado.locks.Event()
 
     @tornado.gen.coroutine
-    def send_prices(self):
-        self.write_message(price_data)
+    def get(self):
+        try:
+            seconds = float(self.get_query_argument("seconds", 10))
+            interval = max(
+                float(self.get_query_argument("interval", settings.PROFILER_INTERVAL)),
+                settings.PROFILER_MIN_INTERVAL,
+            )
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        all_threads = self.FLAGS.get(self.get_query_argument("all", "").lower())
+        if all_threads is None:
+            raise tornado.web.HTTPError(400)
+        if profiler.running:
+            raise tornado.web.HTTPError(409, "A profile is already being taken")
+        profiler.start(interval, all_threads)
+        # Event.wait's own timeout logs a CancelledError when it fires
+        try:
+            yield tornado.gen.with_timeout(
+                timedelta(seconds=min(seconds, settings.PROFILER_MAX_SECONDS)),
+                self.stop_early.wait(),
+            )
+        except tornado.gen.TimeoutError:
+            pass
+        stacks = profiler.stop()
+        self.set_header("Content-Type", "text/plain")
+        self.write(stacks)
+
+    # No one is waiting for the result any more
+    def on_connection_close(self):
+        self.stop_early.set()
+
+
+class HubStatsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write(dict(hub.stats(), order_writer=order_queue.stats()))
 
 
 class SubmitHandler(tornado.web.RequestHandler):
@@ -328,6 +353,7 @@ class SubmitHandler(tornado.web.RequestHandler):
         )
         data["ts"] = int(time.time())
         data["type"] = "order"
+        data["origin"] = order_writer.ORIGIN
         order = []
         for i in range(0, 5):
             stock = data["order"][i]
@@ -340,131 +366,317 @@ class SubmitHandler(tornado.web.RequestHandler):
             }
             order.append(d)
         data["order"] = order
-        default_collection.upsert(key, data)
+        yield order_queue.submit(key, dict(data))
+        if channel is not None:
+            channel.send("order", broadcast.encode(data))
+        else:
+            accept_order(data)
+        ORDER_LAG.labels("submit").observe(self.request.request_time())
 
 
 class SearchHandler(tornado.web.RequestHandler):
-    http_client = AsyncHTTPClient()
-
     @tornado.gen.coroutine
     def get(self):
-        if fts_nodes:
-            query = self.get_query_argument("q")
-            query = query.replace('"', r"")
-            query = urllib.parse.quote(query)
-            terms = query.split()
-            query = " ".join(["{}~1".format(term) for term in terms])
-            data = (
-                '{"query": {"query": "'
-                + query
-                + '"}, "highlight": null, "fields": null, "facets": null, "explain": false}'
-            )
-            fts_node = random.choice(fts_nodes)
-            request = HTTPRequest(
-                url="http://{}:8094/api/index/cbex/query".format(fts_node),
-                method="POST",
-                body=data,
-                auth_username=settings.ADMIN_USER,
-                auth_password=settings.ADMIN_PASS,
-                auth_mode="basic",
-                headers={"Content-Type": "application/json"},
-            )
-            response = yield self.http_client.fetch(request)
-
-            response = tornado.escape.json_decode(response.body)
-
-            final_results = []
-            for hit in response["hits"]:
-                final_results.append(hit["id"])
+        query = self.get_query_argument("q")
+        terms = " ".join(sorted(set(search.words(query))))
+        cache_key = (settings.SEARCH_BACKEND, stock_catalog.version, terms)
+        final_results = search_cache.get(cache_key)
+        if final_results is None:
+            if settings.SEARCH_BACKEND == "fts":
+                final_results = yield fts.search(query)
+            else:
+                if not stock_catalog.loaded:
+                    yield load_catalog()
+                final_results = stock_catalog.find(terms)
+            search_cache.put(cache_key, final_results)
 
-            self.write({"keys": final_results})
-        else:
-            raise Exception("No FTS node found")
+        self.write({"keys": final_results})
 
 
+# Filters the catalog by any number of sectors (?type=...&type=...) and an
+# optional price change range (?min_change=...&max_change=...)
 class FilterHandler(tornado.web.RequestHandler):
     @tornado.gen.coroutine
     def get(self):
-        data = self.get_query_argument("type")
-        results = yield cluster.query(
-            'SELECT meta().id FROM {} WHERE sector = "{}"'.format(bucket_name, data)
-        )
+        if not stock_catalog.loaded:
+            yield load_catalog()
+        sectors = self.get_query_arguments("type")
+        try:
+            min_change = self.get_query_argument("min_change", None)
+            max_change = self.get_query_argument("max_change", None)
+            if min_change is not None:
+                min_change = float(min_change)
+            if max_change is not None:
+                max_change = float(max_change)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
 
-        final_results = []
-        for row in results.rows():
-            final_results.append(row["id"])
+        final_results = stock_catalog.index.lookup(sectors, min_change, max_change)
 
         self.write({"keys": final_results})
 
 
+# Merges new orders, from this process or read back from the bucket, into the
+# order log, the holdings, the geo cache and the standings
+def add_orders(new_orders):
+    # Adding to the holdings appends the order to portfolio_cache
+    for portfolio in new_orders:
+        geo_aggregates.add(portfolio_holdings.add(portfolio))
+    # Existing portfolios only move when a price does; otherwise just value
+    # the new orders and merge them into the standings
+    if not revalue_pending:
+        for portfolio in new_orders:
+            investor_leaderboard.add(portfolio)
+
+
+# Publishes an order submitted here or in a web worker
+def accept_order(order):
+    add_orders([order])
+    # Show the order straight away unless the ticker is still busy
+    if order_feed.idle:
+        hub["orders"].poll()
+    hub["investors"].poll()
+
+
+# What the ingester hears from the web workers
+def from_worker(name, payload):
+    if name == "order":
+        accept_order(tornado.escape.json_decode(payload))
+
+
+# Applies what a web worker hears from the ingester
+def from_ingester(name, payload):
+    if name == "prices":
+        changed = tornado.escape.json_decode(payload)["prices"]
+        for symbol, entry in changed.items():
+            price_data[symbol] = entry
+            stock_catalog.update({"symbol": symbol, "price": entry["price"]})
+        price_broadcaster.publish(list(changed))
+    elif name == "cluster":
+        cluster_status.publish(tornado.escape.json_decode(payload))
+    elif name == "catalog":
+        cas = tornado.escape.json_decode(payload)
+        if stock_catalog.loaded and cas != stock_catalog.cas:
+            tornado.ioloop.IOLoop.current().spawn_callback(refresh_catalog)
+    else:
+        hub[name].publish(payload)
+
+
+def publish_cluster_status():
+    hub["status"].poll()
+
+
+def update_fts_nodes():
+    fts.set_nodes(cluster_status.snapshot["fts_nodes"])
+
+
+@tornado.gen.coroutine
+def load_catalog(company_list=None):
+    if company_list is None:
+        company_list = yield data_access.get(settings.PRODUCT_LIST)
+    stocks = yield data_access.get_multi(company_list.value["symbols"])
+    stock_catalog.load(
+        company_list.cas,
+        {key: result.value for key, result in stocks.results.items()},
+    )
+
+
+# Reloads the catalog only if the product list document has changed
+@tornado.gen.coroutine
+def refresh_catalog():
+    company_list = yield data_access.get(settings.PRODUCT_LIST)
+    if company_list.cas != stock_catalog.cas:
+        yield load_catalog(company_list)
+
+
+# Returns whether the symbol's price or change actually moved
+def apply_price(row):
+    price = float(row["price"])
+    starting_price = float(row["starting_price"])
+    entry = {
+        "price": price,
+        "change": price_feed.price_change(price, starting_price),
+    }
+    if price_data.get(row["symbol"]) == entry:
+        return False
+    price_data[row["symbol"]] = entry
+    if board is not None:
+        board.set(row["symbol"], price, entry["change"], starting_price)
+    # Rows from the price board carry no company, so keep the one we have
+    previous = stock_performance.get(row["symbol"], {})
+    stock_performance[row["symbol"]] = {
+        "price_diff": 100 * (price - starting_price) / starting_price,
+        "symbol": row["symbol"],
+        "company": row.get("company", previous.get("company")),
+        "starting_price": starting_price,
+        "price": price,
+    }
+    return True
+
+
+# The query-backed alternative to ranking stock_performance in memory
+@tornado.gen.coroutine
+def query_stock_leaderboard():
+    good_performers, poor_performers = yield [
+        data_access.execute(queries.BEST_STOCKS, stock_leaderboard.size),
+        data_access.execute(queries.WORST_STOCKS, stock_leaderboard.size),
+    ]
+    stock_leaderboard.set(good_performers, poor_performers)
+
+
+# Reads the orders after `cursor`, a [ts, key] list that is moved on in place,
+# a page a tick. Until the ingest has caught up with the bucket (and so the
+# geo cache is warm) it reads the backlog in big pages, one after another,
+# until one comes back short.
 @tornado.gen.coroutine
-def update_cb_status():
-    global nodes, fts_enabled, n1ql_enabled, xdcr_enabled, fts_nodes
-    # Update the cached node info every 500ms
+def ingest_orders(cursor):
     while True:
-        nodes = yield cb_status.get_node_status()
-        n1ql_enabled = yield cb_status.n1ql_enabled()
-        xdcr_enabled = yield cb_status.xdcr_enabled()
-        fts_nodes = yield cb_status.fts_nodes()
-        fts_enabled = yield cb_status.fts_enabled()
-        yield tornado.gen.sleep(0.5)
+        warm = geo_aggregates.warm
+        page = ORDER_PAGE if warm else settings.ORDER_BACKFILL_PAGE
+        with TICK_SECONDS.labels("orders").time():
+            res = yield data_access.execute(
+                queries.ORDERS, order_writer.ORIGIN, *cursor, page
+            )
+
+        with TICK_SECONDS.labels("ingest").time():
+            last = None
+            for order in res:
+                last = [order["ts"], order.pop("id")]
+                if warm:
+                    ORDER_LAG.labels("bucket").observe(time.time() - order["ts"])
+                    print(("New Order: ", order["name"], order["ts"]))
+            add_orders(res)
+            # Only once the page is in, so a page that fails is read again
+            if last is not None:
+                cursor[:] = last
+        if warm:
+            return
+        print("Backfilled {} orders".format(len(res)))
+        # A short page means the ingest has caught up with the bucket
+        if len(res) < page:
+            geo_aggregates.warm = True
+            return
 
 
 @tornado.gen.coroutine
 def update_price_data():
-    global price_data, portfolio_cache
-    LATEST_TS = 0
+    global price_data, revalue_pending, last_tick
+    # Orders are read in (ts, key) order; ts alone is only to the second
+    order_cursor = [0, ""]
+    price_cursor = None
+    tick = 0
     while True:
         call_time = time.time()
+        # Delta and board modes only read prices changed since the last
+        # cursor, with a periodic full rescan of the bucket in case the cursor
+        # ever skipped a mutation
+        if (
+            settings.PRICE_INGEST_MODE == "full"
+            or tick % settings.PRICE_FULL_REFRESH_TICKS == 0
+        ):
+            price_cursor = None
+        tick += 1
         try:
-            results = cluster.query(
-                f"SELECT symbol,price,starting_price FROM {bucket_name} WHERE symbol IS NOT MISSING AND price IS NOT MISSING",
-            )
+            with TICK_SECONDS.labels("prices").time():
+                rows, price_cursor = yield data_access.call(
+                    "query", "prices", prices.changes, price_cursor
+                )
         except Exception as e:
             print(e)
+            yield tornado.gen.sleep(2)
             continue
 
-        final_results = {}
-        for row in results.rows():
-            price_change = round(
-                ((float(row["price"]) - float(row["starting_price"])) * 100)
-                / float(row["starting_price"]),
-                2,
-            )
-            price_data[row["symbol"]] = {
-                "price": float(row["price"]),
-                "change": price_change,
-            }
-        query = f"SELECT * FROM {bucket_name} WHERE type='order' and ts > {LATEST_TS} ORDER BY ts ASC LIMIT 50;"
+        with TICK_SECONDS.labels("catalog").time():
+            changed = [row["symbol"] for row in rows if apply_price(row)]
+            for row in rows:
+                stock_catalog.update(row)
+            try:
+                yield refresh_catalog()
+            except Exception as e:
+                print(e)
+            hub["catalog"].poll()
+        with TICK_SECONDS.labels("publish").time():
+            for symbol in changed:
+                portfolio_holdings.set_price(symbol, price_data[symbol]["price"])
+            price_broadcaster.publish(changed)
+            if changed:
+                history.record(
+                    changed,
+                    [price_data[symbol]["price"] for symbol in changed],
+                    call_time,
+                )
+                revalue_pending = True
+
+        # Rank the stocks once per tick and share the result with every socket
+        with TICK_SECONDS.labels("stock_leaderboard").time():
+            if settings.STOCK_LEADERBOARD_MODE == "query":
+                try:
+                    yield query_stock_leaderboard()
+                except Exception as e:
+                    print(e)
+            elif changed:
+                stock_leaderboard.rebuild(list(stock_performance.values()))
+
+        # Orders submitted here were published when they were accepted
         try:
-            res = cluster.query(query)
+            yield ingest_orders(order_cursor)
         except Exception as e:
             print(e)
-            tornado.gen.sleep(2)
+            yield tornado.gen.sleep(2)
             continue
 
-        new_order = False
-        for order in res.rows():
-            order = order[bucket_name]
-            portfolio_cache.append(order)
-            LATEST_TS = int(order["ts"])
-            print(("New Order: ", order["name"], order["ts"]))
-
-        for portfolio in portfolio_cache:
-            portfolio_value = 0
-            for stock in portfolio["order"]:
-                current_price = price_data[stock["symbol"]]["price"]
-                quantity = stock["quantity"]
-                stock_value = quantity * current_price
-                portfolio_value += stock_value
-            portfolio["current_value"] = portfolio_value
+        with TICK_SECONDS.labels("revalue").time():
+            if revalue_pending:
+                portfolio_holdings.revalue()
+                investor_leaderboard.rebuild(portfolio_holdings.extremes(5))
+                revalue_pending = False
 
         result_time = time.time()
+        last_tick = result_time
         response_time = result_time - call_time
+        TICK_SECONDS.labels("total").observe(response_time)
         if response_time < 5:  # don't go again til 5s has elaspsed
             yield tornado.gen.sleep(5 - response_time)
 
 
+# Points the app at a cluster: the one in settings unless another (such as
+# the in-memory one the benchmarks use) is passed in
+def connect(target=None):
+    global cluster, default_collection, prices
+    if target is None:
+        # Connect options - authentication
+        auth = PasswordAuthenticator(
+            user,
+            password,
+        )
+        # Get a reference to our cluster
+        # NOTE: For TLS/SSL connection use 'couchbases://<your-ip-address>' instead
+        target = Cluster(f"couchbase://{node}", ClusterOptions(auth))
+
+        # Wait until the cluster is ready for use.
+        target.wait_until_ready(
+            timedelta(seconds=3),
+            WaitUntilReadyOptions(
+                service_types=[ServiceType.KeyValue, ServiceType.Query]
+            ),
+        )
+
+    cluster = target
+    default_collection = cluster.bucket(bucket_name).default_collection()
+    data_access.cluster = cluster
+    data_access.collection = default_collection
+    prices = price_feed.N1QLPriceFeed(cluster)
+    if settings.PRICE_INGEST_MODE == "board":
+        if os.path.exists(settings.PRICE_BOARD_FILE):
+            prices = price_feed.BoardPriceFeed(price_board.PriceBoard(), prices)
+        else:
+            print(
+                "No price board at {}, reading prices from the bucket".format(
+                    settings.PRICE_BOARD_FILE
+                )
+            )
+
+
 def make_app():
     return tornado.web.Application(
         [
@@ -482,6 +694,9 @@ def make_app():
             (r"/submit_order", SubmitHandler),
             (r"/search", SearchHandler),
             (r"/filter", FilterHandler),
+            (r"/history", HistoryHandler),
+            (r"/hubstats", HubStatsHandler),
+            (r"/metrics", MetricsHandler),
             # This is lazy, but will work fine for our purposes
             (r"/(.*)", tornado.web.StaticFileHandler, {"path": "./www/"}),
         ],
@@ -489,12 +704,98 @@ def make_app():
     )
 
 
-if __name__ == "__main__":
-    port = settings.WEB_PORT
-    print(("Running at http://localhost:{}").format(port))
-    app = make_app()
-    app.listen(port)
-    print("Initzializing...")
-    tornado.ioloop.IOLoop.current().spawn_callback(update_cb_status)
+# The only handlers the ingester serves, /geo for the web workers. It is also
+# the only app with /admin/profile, since a profile exposes every thread's
+# stack, so it listens on ADMIN_ADDRESS.
+def make_admin_app():
+    return tornado.web.Application(
+        [
+            (r"/hubstats", HubStatsHandler),
+            (r"/metrics", MetricsHandler),
+            (r"/admin/profile", ProfileHandler),
+            (r"/geo", GeoLeaderboardHandler),
+        ]
+    )
+
+
+def start_ingest():
+    global board
+    if settings.PRICE_INGEST_MODE != "board":
+        board = price_board.PriceBoard(writable=True)
+    cluster_status.subscribe(update_fts_nodes)
+    cluster_status.subscribe(publish_cluster_status)
+    tornado.ioloop.IOLoop.current().spawn_callback(cluster_status.run)
     tornado.ioloop.IOLoop.current().spawn_callback(update_price_data)
+
+
+# Polls the cluster for `processes` web workers, which it starts (and
+# restarts) itself
+def run_ingester(processes):
+    make_admin_app().listen(settings.ADMIN_PORT, settings.ADMIN_ADDRESS)
+    if os.path.exists(options.channel):
+        os.remove(options.channel)
+    server = workers.ChannelServer(hub, RELAYED, from_worker)
+    server.listen_unix(options.channel)
+    cluster_status.subscribe(hub["cluster"].poll)
+    start_ingest()
+    supervisor = workers.Supervisor(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--role=worker",
+            "--channel=" + options.channel,
+            "--origin=" + order_writer.ORIGIN,
+        ],
+        processes,
+    )
+    supervisor.start()
+    print(
+        ("Ingesting for {} web workers at http://localhost:{}").format(
+            processes, settings.WEB_PORT
+        )
+    )
+
+
+# Serves the web port alongside the other workers. Orders are tagged with the
+# ingester's origin, since it publishes them and its order poll skips them.
+@tornado.gen.coroutine
+def run_worker():
+    global channel
+    order_writer.ORIGIN = options.origin
+    for name in ("orders", "stocks", "investors"):
+        hub[name].source = None
+        hub[name].interval = None
+    cluster_status.subscribe(update_fts_nodes)
+    cluster_status.subscribe(publish_cluster_status)
+    channel = workers.Channel(options.channel, from_ingester)
+    try:
+        yield channel.connect()
+    except tornado.iostream.StreamClosedError:
+        print(("No ingester listening on {}, exiting").format(options.channel))
+        tornado.ioloop.IOLoop.current().stop()
+        return
+    tornado.ioloop.IOLoop.current().spawn_callback(channel.run)
+    server = tornado.httpserver.HTTPServer(make_app())
+    server.add_sockets(tornado.netutil.bind_sockets(settings.WEB_PORT, reuse_port=True))
+    order_queue.start()
+
+
+if __name__ == "__main__":
+    options.parse_command_line()
+    connect()
+    loop_monitor.LoopMonitor().start()
+    processes = settings.WEB_PROCESSES or tornado.process.cpu_count()
+    if options.role == "worker":
+        tornado.ioloop.IOLoop.current().spawn_callback(run_worker)
+    elif processes > 1:
+        run_ingester(processes)
+    else:
+        port = settings.WEB_PORT
+        print(("Running at http://localhost:{}").format(port))
+        app = make_app()
+        app.listen(port)
+        make_admin_app().listen(settings.ADMIN_PORT, settings.ADMIN_ADDRESS)
+        print("Initzializing...")
+        start_ingest()
+        order_queue.start()
     tornado.ioloop.IOLoop.current().start()
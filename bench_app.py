@@ -0,0 +1,484 @@
+#!/usr/bin/env - python
+# Load test for app.py. The app runs in a child process against the in-memory
+# cluster from fake_cluster.py, seeded with synthetic stocks and orders while
+# live_market.py moves the prices. This process holds websocket clients open
+# on every socket route and sends /submit_order, /filter and /search requests
+# at fixed rates, then reports throughput, latency percentiles, the app's
+# event loop lag and RSS as JSON.
+#
+#   $ python bench_app.py --clients=2000 --submit_rate=200 --output=baseline.json
+#   $ python bench_app.py --clients=2000 --submit_rate=200 --baseline=baseline.json
+#
+# With --baseline, every metric more than --tolerance worse than the baseline
+# is listed and the exit status is 1.
+
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import threading
+import time
+
+import tornado.escape
+import tornado.gen
+import tornado.httpclient
+import tornado.ioloop
+import tornado.options
+import tornado.web
+import tornado.websocket
+
+import broadcast
+import create_dataset
+import settings
+
+options = tornado.options.OptionParser()
+options.define("port", default=8899, help="port the app listens on")
+options.define("stocks", default=1000, help="synthetic stocks in the catalog")
+options.define("orders", default=100000, help="synthetic orders already placed")
+options.define("market_rate", default=2.0, help="price ticks per second")
+options.define("clients", default=1000, help="websocket clients, over all routes")
+options.define("submit_rate", default=100.0, help="orders submitted per second")
+options.define("filter_rate", default=100.0, help="/filter requests per second")
+options.define("search_rate", default=100.0, help="/search requests per second")
+options.define("http_clients", default=200, help="HTTP requests in flight at most")
+options.define("warmup", default=10.0, help="seconds before measuring")
+options.define("duration", default=30.0, help="seconds to measure for")
+options.define("seed", default=1, help="seed for the data and the traffic")
+options.define("packed", default=False, help="ask for the packed price format")
+options.define("deflate", default=False, help="offer permessage-deflate")
+options.define("ack", default=False, help="acknowledge each live price version")
+options.define("output", default="", help="file to write the results to")
+options.define("baseline", default="", help="results to compare against")
+options.define("tolerance", default=0.2, help="fraction worse that is a regression")
+
+SOCKET_ROUTES = (
+    "/liveprices",
+    "/liveorders",
+    "/stockleaderboard",
+    "/investorleaderboard",
+    "/nodestatus",
+)
+# Seconds between the app's loop lag samples
+LAG_INTERVAL = 0.05
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def milliseconds(samples):
+    return {
+        "p50_ms": round(1000 * percentile(samples, 0.5), 3) if samples else None,
+        "p99_ms": round(1000 * percentile(samples, 0.99), 3) if samples else None,
+    }
+
+
+def raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# The app side
+
+
+# How late a timer that should fire every LAG_INTERVAL actually runs
+class LagMonitor(object):
+    def __init__(self):
+        self.samples = []
+        self.expected = None
+
+    def start(self):
+        self.expected = time.time() + LAG_INTERVAL
+        tornado.ioloop.IOLoop.current().call_later(LAG_INTERVAL, self.check)
+
+    def check(self):
+        now = time.time()
+        self.samples.append(max(now - self.expected, 0))
+        self.expected = now + LAG_INTERVAL
+        tornado.ioloop.IOLoop.current().call_later(LAG_INTERVAL, self.check)
+
+
+class BenchStatsHandler(tornado.web.RequestHandler):
+    def initialize(self, app, monitor):
+        self.app = app
+        self.monitor = monitor
+
+    def get(self):
+        lag = self.monitor.samples
+        stats = {
+            "loop_lag_ms": dict(
+                milliseconds(lag), max_ms=round(1000 * max(lag), 3) if lag else None
+            ),
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1
+            ),
+            "orders": len(self.app.portfolio_cache),
+            "prices": len(self.app.price_data),
+            "topics": self.app.hub.stats(),
+            "order_writer": self.app.order_queue.stats(),
+        }
+        if self.get_query_argument("reset", None):
+            del self.monitor.samples[:]
+        self.write(stats)
+
+
+def serve(config):
+    raise_file_limit()
+    # The app says hello to every socket; that's not what we're measuring
+    sys.stdout = open(os.devnull, "w")
+
+    import app
+    import fake_cluster
+    import live_market
+
+    cluster = fake_cluster.FakeCluster()
+    collection = cluster.collection
+    stocks = list(create_dataset.synthetic_stocks(config["stocks"], config["seed"]))
+    for stock in stocks:
+        collection.upsert("stock:" + stock["symbol"], stock)
+    collection.upsert(
+        settings.PRODUCT_LIST,
+        {"symbols": ["stock:" + stock["symbol"] for stock in stocks]},
+    )
+    for key, doc in create_dataset.synthetic_orders(
+        config["orders"], stocks, config["seed"]
+    ):
+        collection.upsert(key, doc)
+
+    market = live_market.Market(
+        [stock["symbol"] for stock in stocks],
+        [stock["price"] for stock in stocks],
+        settings.MARKET_DRIFT,
+        settings.MARKET_VOLATILITY,
+        1.0 / config["market_rate"],
+        config["seed"],
+    )
+    pusher = live_market.PricePusher(collection, 2)
+    threading.Thread(
+        target=live_market.run,
+        args=(market, pusher, config["market_rate"]),
+        daemon=True,
+    ).start()
+
+    app.connect(cluster)
+    application = app.make_app()
+    monitor = LagMonitor()
+    application.add_handlers(
+        r".*", [(r"/bench/stats", BenchStatsHandler, {"app": app, "monitor": monitor})]
+    )
+    application.listen(config["port"])
+    monitor.start()
+    tornado.ioloop.IOLoop.current().spawn_callback(app.update_price_data)
+    app.order_queue.start()
+    tornado.ioloop.IOLoop.current().start()
+
+
+# The client side
+
+
+class Traffic(object):
+    def __init__(self, base_url, symbols, rng):
+        self.base_url = base_url
+        self.symbols = symbols
+        self.rng = rng
+        self.http = tornado.httpclient.AsyncHTTPClient(max_clients=options.http_clients)
+        self.measuring = False
+        self.requests = {}
+        self.sockets = {
+            route: {"clients": 0, "failed": 0, "closed": 0, "messages": 0, "bytes": 0}
+            for route in SOCKET_ROUTES
+        }
+        self.connect_times = []
+        self.connections = []
+
+    @tornado.gen.coroutine
+    def follow(self, route):
+        stats = self.sockets[route]
+        start = time.time()
+        try:
+            connection = yield tornado.websocket.websocket_connect(
+                self.base_url.replace("http", "ws", 1) + route,
+                compression_options={} if options.deflate else None,
+                subprotocols=[broadcast.PACKED] if options.packed else None,
+            )
+        except Exception:
+            stats["failed"] += 1
+            return
+        self.connect_times.append(time.time() - start)
+        self.connections.append(connection)
+        stats["clients"] += 1
+        while True:
+            message = yield connection.read_message()
+            if message is None:
+                stats["closed"] += 1
+                return
+            if self.measuring:
+                stats["messages"] += 1
+                stats["bytes"] += len(message)
+            if route == "/liveprices" and options.ack:
+                # live_prices.js never acknowledges, so neither does the
+                # default run. Packed prices come as binary; their text frames
+                # number symbols.
+                if isinstance(message, bytes):
+                    version = broadcast.PRICE_HEADER.unpack_from(message)[0]
+                else:
+                    version = json.loads(message).get("version")
+                if version is not None:
+                    connection.write_message(str(version))
+
+    @tornado.gen.coroutine
+    def connect(self, clients, concurrency=100):
+        routes = [SOCKET_ROUTES[i % len(SOCKET_ROUTES)] for i in range(clients)]
+        for start in range(0, clients, concurrency):
+            opened = len(self.connections)
+            for route in routes[start : start + concurrency]:
+                tornado.ioloop.IOLoop.current().spawn_callback(self.follow, route)
+            # Wait for this wave to open (or fail) before starting the next
+            deadline = time.time() + 10
+            expected = min(concurrency, clients - start)
+            while time.time() < deadline:
+                failed = sum(stats["failed"] for stats in self.sockets.values())
+                if len(self.connections) + failed >= opened + expected:
+                    break
+                yield tornado.gen.sleep(0.01)
+
+    def submit_order(self):
+        return tornado.httpclient.HTTPRequest(
+            self.base_url + "/submit_order",
+            method="POST",
+            body=json.dumps(
+                {
+                    "name": "Bench {}".format(self.rng.randrange(10000)),
+                    "order": [
+                        "stock:" + symbol for symbol in self.rng.sample(self.symbols, 5)
+                    ],
+                }
+            ),
+        )
+
+    def filter(self):
+        low = self.rng.uniform(-5, 0)
+        return tornado.httpclient.HTTPRequest(
+            "{}/filter?type={}&min_change={:.2f}&max_change={:.2f}".format(
+                self.base_url,
+                tornado.escape.url_escape(self.rng.choice(create_dataset.SECTORS)),
+                low,
+                low + self.rng.uniform(0, 5),
+            )
+        )
+
+    def search(self):
+        word = self.rng.choice(create_dataset.COMPANY_WORDS).lower()
+        # A mix of whole words, typeahead prefixes and typos
+        word = self.rng.choice(
+            [word, word[: self.rng.randint(1, len(word))], word[1:], word + "x"]
+        )
+        return tornado.httpclient.HTTPRequest(
+            "{}/search?q={}".format(self.base_url, tornado.escape.url_escape(word))
+        )
+
+    @tornado.gen.coroutine
+    def send(self, name, request):
+        stats = self.requests[name]
+        stats["in_flight"] += 1
+        start = time.time()
+        response = yield self.http.fetch(request, raise_error=False)
+        elapsed = time.time() - start
+        stats["in_flight"] -= 1
+        if not self.measuring:
+            return
+        if response.code == 200:
+            stats["latencies"].append(elapsed)
+        else:
+            stats["errors"] += 1
+
+    # Open loop: requests go out on schedule whether or not earlier ones have
+    # answered, unless http_clients are already waiting
+    @tornado.gen.coroutine
+    def drive(self, name, make_request, rate, until):
+        if rate <= 0:
+            return
+        self.requests[name] = {
+            "latencies": [],
+            "errors": 0,
+            "skipped": 0,
+            "in_flight": 0,
+        }
+        stats = self.requests[name]
+        interval = 1.0 / rate
+        next_request = time.time()
+        while next_request < until:
+            if stats["in_flight"] >= options.http_clients:
+                stats["skipped"] += 1
+            else:
+                tornado.ioloop.IOLoop.current().spawn_callback(
+                    self.send, name, make_request()
+                )
+            next_request += interval
+            yield tornado.gen.sleep(max(next_request - time.time(), 0))
+
+    def results(self, duration):
+        http = {}
+        for name, stats in self.requests.items():
+            http[name] = dict(
+                milliseconds(stats["latencies"]),
+                requests=len(stats["latencies"]),
+                per_second=round(len(stats["latencies"]) / duration, 1),
+                errors=stats["errors"],
+                skipped=stats["skipped"],
+            )
+        sockets = {}
+        for route, stats in self.sockets.items():
+            sockets[route] = dict(
+                stats,
+                messages_per_second=round(stats["messages"] / duration, 1),
+            )
+        return {
+            "http": http,
+            "websockets": dict(sockets, connect=milliseconds(self.connect_times)),
+        }
+
+
+@tornado.gen.coroutine
+def fetch_stats(base_url, reset=False):
+    client = tornado.httpclient.AsyncHTTPClient()
+    response = yield client.fetch(
+        base_url + "/bench/stats" + ("?reset=1" if reset else "")
+    )
+    raise tornado.gen.Return(json.loads(response.body))
+
+
+@tornado.gen.coroutine
+def run_bench():
+    base_url = "http://127.0.0.1:{}".format(options.port)
+    deadline = time.time() + 120
+    while True:
+        try:
+            yield fetch_stats(base_url)
+            break
+        except Exception:
+            if time.time() > deadline:
+                raise
+            yield tornado.gen.sleep(0.5)
+
+    stocks = create_dataset.synthetic_stocks(options.stocks, options.seed)
+    traffic = Traffic(
+        base_url,
+        [stock["symbol"] for stock in stocks],
+        random.Random(options.seed),
+    )
+    yield traffic.connect(options.clients)
+    yield tornado.gen.sleep(options.warmup)
+
+    yield fetch_stats(base_url, reset=True)
+    traffic.measuring = True
+    start = time.time()
+    until = start + options.duration
+    yield [
+        traffic.drive(
+            "/submit_order", traffic.submit_order, options.submit_rate, until
+        ),
+        traffic.drive("/filter", traffic.filter, options.filter_rate, until),
+        traffic.drive("/search", traffic.search, options.search_rate, until),
+    ]
+    duration = time.time() - start
+    traffic.measuring = False
+    server = yield fetch_stats(base_url)
+    for connection in traffic.connections:
+        connection.close()
+
+    results = traffic.results(duration)
+    results["server"] = server
+    results["options"] = {
+        name: getattr(options, name)
+        for name in (
+            "stocks",
+            "orders",
+            "market_rate",
+            "clients",
+            "submit_rate",
+            "filter_rate",
+            "search_rate",
+            "duration",
+            "seed",
+            "packed",
+            "deflate",
+            "ack",
+        )
+    }
+    raise tornado.gen.Return(results)
+
+
+# Every numeric metric, keyed by its path, that has a better direction:
+# rates are better higher, times and memory lower
+def metrics(results, prefix=""):
+    found = {}
+    for name, value in results.items():
+        path = prefix + "." + name if prefix else name
+        if isinstance(value, dict):
+            found.update(metrics(value, path))
+        elif prefix.startswith("options") or not isinstance(value, (int, float)):
+            continue
+        elif name.endswith("per_second"):
+            found[path] = (value, 1)
+        elif name.endswith("_ms") or name.endswith("_mb"):
+            found[path] = (value, -1)
+    return found
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    current = metrics(results)
+    for path, (base, better) in metrics(baseline).items():
+        if path not in current or not base:
+            continue
+        value = current[path][0]
+        change = (value - base) / base * better
+        # Sub-millisecond timings are mostly noise
+        if path.endswith("_ms") and abs(value - base) < 1:
+            continue
+        if change < -tolerance:
+            found.append("{}: {} -> {} ({:+.0%})".format(path, base, value, change))
+    return found
+
+
+if __name__ == "__main__":
+    options.parse_command_line()
+    raise_file_limit()
+
+    server = multiprocessing.get_context("fork").Process(
+        target=serve,
+        args=(
+            {
+                "port": options.port,
+                "stocks": options.stocks,
+                "orders": options.orders,
+                "market_rate": options.market_rate,
+                "seed": options.seed,
+            },
+        ),
+        daemon=True,
+    )
+    server.start()
+    try:
+        results = tornado.ioloop.IOLoop.current().run_sync(run_bench)
+    finally:
+        server.terminate()
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline, "r") as f:
+            found = regressions(results, json.load(f), options.tolerance)
+        for regression in found:
+            print("REGRESSION " + regression)
+        if found:
+            sys.exit(1)
@@ -0,0 +1,106 @@
+#!/usr/bin/env - python
+# Compares the original per-portfolio revaluation loop from update_price_data
+# against the columnar Holdings engine, on synthetic portfolios.
+#
+#   $ python bench_revalue.py [sizes...]
+
+import json
+import random
+import sys
+import time
+
+import holdings
+import orders
+import settings
+
+SIZES = [10000, 100000, 1000000]
+
+
+def make_prices():
+    with open(settings.STOCKS_FILE, "r") as stocks_json:
+        stocks = json.load(stocks_json)[: settings.NUM_STOCKS]
+    return {stock["symbol"]: {"price": float(stock["price"])} for stock in stocks}
+
+
+def make_portfolios(count, price_data, rng):
+    symbols = list(price_data)
+    portfolios = []
+    for i in range(count):
+        order = []
+        for symbol in rng.sample(symbols, orders.ORDER_WIDTH):
+            order.append(
+                {
+                    "symbol": symbol,
+                    "purchase_price": price_data[symbol]["price"],
+                    "quantity": 100.0 / price_data[symbol]["price"],
+                }
+            )
+        portfolios.append({"name": "Investor {}".format(i), "ts": i, "order": order})
+    return portfolios
+
+
+# The loop update_price_data used to run over portfolio_cache every tick
+def python_revalue(portfolio_cache, price_data):
+    for portfolio in portfolio_cache:
+        portfolio_value = 0
+        for stock in portfolio["order"]:
+            current_price = price_data[stock["symbol"]]["price"]
+            quantity = stock["quantity"]
+            stock_value = quantity * current_price
+            portfolio_value += stock_value
+        portfolio["current_value"] = portfolio_value
+
+
+def perturb(price_data, store, rng):
+    for symbol, entry in price_data.items():
+        entry["price"] = round(entry["price"] * rng.normalvariate(1, 0.025), 2)
+        store.set_price(symbol, entry["price"])
+
+
+def best_of(repeat, fn, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def numpy_revalue(store):
+    store.revalue()
+    store.extremes(5)
+
+
+def run(count, repeat=3):
+    rng = random.Random(count)
+    price_data = make_prices()
+    portfolio_cache = make_portfolios(count, price_data, rng)
+    store = holdings.Holdings(price_data, orders.OrderLog())
+    for portfolio in portfolio_cache:
+        store.add(portfolio)
+    perturb(price_data, store, rng)
+
+    python_time = best_of(repeat, python_revalue, portfolio_cache, price_data)
+    numpy_time = best_of(repeat, numpy_revalue, store)
+
+    # Both engines must agree before the timings mean anything
+    store.revalue()
+    worst = max(
+        abs(store.log.record(row)["value"] - portfolio["current_value"])
+        for row, portfolio in enumerate(portfolio_cache)
+    )
+    assert worst < 1e-6, worst
+
+    print(
+        (
+            "{:>9} portfolios  python {:8.1f} ms  numpy {:7.1f} ms  speedup {:6.1f}x"
+        ).format(count, python_time * 1000, numpy_time * 1000, python_time / numpy_time)
+    )
+
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    for size in sizes:
+        run(size)
@@ -0,0 +1,312 @@
+#!/usr/bin/env - python
+import collections
+import struct
+
+import numpy as np
+import tornado.escape
+import tornado.ioloop
+import tornado.websocket
+
+import metrics
+
+FANOUT_SECONDS = metrics.Histogram(
+    "cbex_fanout_seconds", "Time to queue one message for every subscriber", ["topic"]
+)
+PAYLOAD_BYTES = metrics.Histogram(
+    "cbex_payload_bytes",
+    "Size of each encoded message",
+    ["topic"],
+    buckets=metrics.SIZE_BUCKETS,
+)
+SENT_BYTES = metrics.Counter(
+    "cbex_sent_bytes_total", "Bytes written to websocket clients", ["topic"]
+)
+
+
+# Websocket subprotocol a client asks for to get prices in the packed format:
+# a text frame {"start": n, "symbols": [...]} numbering any symbols it hasn't
+# been told about yet from n onwards, then binary frames of a PRICE_HEADER
+# followed by `count` PRICE_RECORDs in place of the JSON messages
+PACKED = "cbex.packed"
+# version, count
+PRICE_HEADER = struct.Struct("<II")
+# symbol number, price, change
+PRICE_RECORD = np.dtype([("id", "<u4"), ("price", "<f8"), ("change", "<f4")])
+
+
+def encode(msg):
+    return tornado.escape.utf8(tornado.escape.json_encode(msg))
+
+
+# Shared publisher for the live prices sockets. Every publish bumps the version
+# and encodes the changed symbols once per format; each subscriber that
+# already holds the previous version is sent those same bytes. Subscribers
+# further behind (a skipped write, an old ack) get a catch-up delta, new ones
+# a full snapshot. Symbols are numbered as they are first published, and
+# the numbers are shared by every packed subscriber.
+class PriceBroadcaster(object):
+    def __init__(self, prices):
+        self.prices = prices
+        self.version = 0
+        self.sent = {}
+        self.changed_at = {}
+        self.snapshot = {}
+        self.symbols = []
+        self.symbol_ids = {}
+        self.subscribers = {}
+        # Packed subscribers, and how many symbols each has been told about
+        self.packed = {}
+        self.pending = {}
+        self.delivered = 0
+        self.dropped = 0
+        self.fanout_seconds = FANOUT_SECONDS.labels("prices")
+        self.payload_bytes = PAYLOAD_BYTES.labels("prices")
+        self.sent_bytes = SENT_BYTES.labels("prices")
+
+    def subscribe(self, socket, packed=False):
+        self.subscribers[socket] = None
+        if packed:
+            self.packed[socket] = 0
+        self.send(socket, self.full(packed))
+
+    def unsubscribe(self, socket):
+        self.subscribers.pop(socket, None)
+        self.packed.pop(socket, None)
+        self.pending.pop(socket, None)
+
+    # Clients acknowledge by sending back the last version they applied;
+    # anything else is treated as a request for a full resync
+    def receive(self, socket, message):
+        try:
+            version = int(message)
+        except ValueError:
+            version = None
+        if version is not None and version > self.version:
+            version = None
+        self.subscribers[socket] = version
+        if version != self.version:
+            self.send(socket, self.catch_up(version, socket in self.packed))
+
+    def publish(self, symbols=None):
+        if symbols is None:
+            symbols = list(self.prices)
+        changed = {}
+        for symbol in symbols:
+            entry = self.prices[symbol]
+            if self.sent.get(symbol) != entry:
+                changed[symbol] = entry
+        if not changed:
+            return
+
+        previous = self.version
+        self.version += 1
+        self.sent.update(changed)
+        for symbol in changed:
+            self.changed_at[symbol] = self.version
+            if symbol not in self.symbol_ids:
+                self.symbol_ids[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+        self.snapshot = {}
+        deltas = {}
+
+        with self.fanout_seconds.time():
+            for socket, version in list(self.subscribers.items()):
+                packed = socket in self.packed
+                if version != previous:
+                    self.send(socket, self.catch_up(version, packed))
+                    continue
+                if packed not in deltas:
+                    deltas[packed] = self.encode(changed, packed)
+                    self.payload_bytes.observe(len(deltas[packed]))
+                self.send(socket, deltas[packed])
+
+    def encode(self, prices, packed):
+        if not packed:
+            return encode({"version": self.version, "prices": prices})
+        records = np.empty(len(prices), dtype=PRICE_RECORD)
+        records["id"] = [self.symbol_ids[symbol] for symbol in prices]
+        records["price"] = [entry["price"] for entry in prices.values()]
+        records["change"] = [entry["change"] for entry in prices.values()]
+        return PRICE_HEADER.pack(self.version, len(prices)) + records.tobytes()
+
+    def full(self, packed=False):
+        if packed not in self.snapshot:
+            self.snapshot[packed] = self.encode(self.sent, packed)
+        return self.snapshot[packed]
+
+    def catch_up(self, version, packed=False):
+        if version is None:
+            return self.full(packed)
+        changed = {
+            symbol: self.sent[symbol]
+            for symbol, changed_at in self.changed_at.items()
+            if changed_at > version
+        }
+        return self.encode(changed, packed)
+
+    # A subscriber whose last write hasn't drained yet is skipped; it keeps its
+    # old version and catches up on a later publish
+    def send(self, socket, payload):
+        pending = self.pending.get(socket)
+        if pending is not None and not pending.done():
+            self.dropped += 1
+            return
+        known = self.packed.get(socket)
+        try:
+            if known is None:
+                self.pending[socket] = socket.write_message(payload)
+            else:
+                if known < len(self.symbols):
+                    socket.write_message(
+                        encode({"start": known, "symbols": self.symbols[known:]})
+                    )
+                    self.packed[socket] = len(self.symbols)
+                self.pending[socket] = socket.write_message(payload, binary=True)
+        except tornado.websocket.WebSocketClosedError:
+            self.unsubscribe(socket)
+            return
+        self.delivered += 1
+        self.sent_bytes.inc(len(payload))
+        self.subscribers[socket] = self.version
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.version,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+# One connected socket's view of a topic: at most `depth` encoded messages
+# waiting behind the write in flight. When a slow client lets the queue fill,
+# the oldest message is dropped so it always catches up to the latest one.
+class Subscriber(object):
+    def __init__(self, topic, socket):
+        self.topic = topic
+        self.socket = socket
+        self.queue = collections.deque(maxlen=topic.depth)
+        self.pending = None
+
+    def deliver(self, payload):
+        if len(self.queue) == self.queue.maxlen:
+            self.topic.dropped += 1
+        self.queue.append(payload)
+        self.flush()
+
+    def flush(self, done=None):
+        if done is not None:
+            # Retrieve the error of a failed write; the next write reports it
+            done.exception()
+        if self.pending is not None and not self.pending.done():
+            return
+        if not self.queue:
+            return
+        payload = self.queue.popleft()
+        try:
+            self.pending = self.socket.write_message(payload)
+        except tornado.websocket.WebSocketClosedError:
+            self.topic.unsubscribe(self.socket)
+            return
+        self.topic.delivered += 1
+        self.topic.sent_bytes.inc(len(payload))
+        self.pending.add_done_callback(self.flush)
+
+
+# A named stream of messages. Each publish is encoded once by the caller and
+# queued for every subscriber. Topics with a `source` poll it on a single
+# timer while anyone is subscribed and publish whatever it returns, unless
+# that is None or the same as the last message.
+class Topic(object):
+    def __init__(self, name, source=None, interval=None, depth=1):
+        self.name = name
+        self.source = source
+        self.interval = interval
+        self.depth = depth
+        self.subscribers = {}
+        self.last = None
+        self.timer = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.fanout_seconds = FANOUT_SECONDS.labels(name)
+        self.payload_bytes = PAYLOAD_BYTES.labels(name)
+        self.sent_bytes = SENT_BYTES.labels(name)
+
+    def subscribe(self, socket):
+        self.subscribers[socket] = Subscriber(self, socket)
+        if self.last is not None:
+            self.subscribers[socket].deliver(self.last)
+        elif self.source is not None:
+            self.poll()
+        if self.interval and self.timer is None:
+            self.timer = tornado.ioloop.PeriodicCallback(
+                self.poll, self.interval * 1000
+            )
+            self.timer.start()
+
+    def unsubscribe(self, socket):
+        self.subscribers.pop(socket, None)
+        if not self.subscribers and self.timer is not None:
+            self.timer.stop()
+            self.timer = None
+
+    def poll(self):
+        payload = self.source()
+        if payload is not None and payload != self.last:
+            self.publish(payload)
+
+    def publish(self, payload):
+        self.last = payload
+        self.published += 1
+        self.payload_bytes.observe(len(payload))
+        with self.fanout_seconds.time():
+            for subscriber in list(self.subscribers.values()):
+                subscriber.deliver(payload)
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+# Registry of every websocket topic, so the fan-out and drop counters can be
+# read in one place
+class Hub(object):
+    def __init__(self):
+        self.topics = {}
+        metrics.Collected(
+            "cbex_websocket_clients",
+            "Connected websocket clients by topic",
+            ["topic"],
+            lambda: self.collect("subscribers"),
+        )
+        for counter in ("published", "delivered", "dropped"):
+            metrics.Collected(
+                "cbex_messages_{}_total".format(counter),
+                "Websocket messages {} by topic".format(counter),
+                ["topic"],
+                lambda counter=counter: self.collect(counter),
+                kind="counter",
+            )
+
+    def collect(self, stat):
+        return {(name,): stats[stat] for name, stats in self.stats().items()}
+
+    def topic(self, name, source=None, interval=None, depth=1):
+        self.topics[name] = Topic(name, source, interval, depth)
+        return self.topics[name]
+
+    # For broadcasters with their own delivery, such as PriceBroadcaster
+    def add(self, name, topic):
+        self.topics[name] = topic
+        return topic
+
+    def __getitem__(self, name):
+        return self.topics[name]
+
+    def stats(self):
+        return {name: topic.stats() for name, topic in self.topics.items()}
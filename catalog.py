@@ -0,0 +1,116 @@
+#!/usr/bin/env - python
+import random
+
+import price_feed
+import search
+import sector_index
+
+# Stands in for the stock rows when the exchange page is pre-rendered
+ROWS_MARKER = "<!-- stock rows -->"
+
+
+# Cache of the product catalog behind the exchange page: every stock document
+# from the product list, the sorted sector list, and the page pre-rendered
+# around its table rows. It is (re)loaded whenever the product list document
+# changes, and price feed rows keep the cached documents current one stock
+# at a time. Only the shuffle of the rows is done per request. `version`
+# moves whenever anything searchable changes, so cached results can key on it.
+class Catalog(object):
+    def __init__(self):
+        self.cas = None
+        self.stocks = {}
+        self.sectors = []
+        self.first_keys = []
+        self.rest = []
+        self.page = None
+        self.rows = {}
+        self.index = sector_index.SectorIndex()
+        self.search = search.SearchIndex()
+        self.search_stale = False
+        self.version = 0
+
+    @property
+    def loaded(self):
+        return self.cas is not None
+
+    def load(self, cas, stocks):
+        self.version += 1
+        self.cas = cas
+        self.stocks = stocks
+        self.sectors = sorted(
+            set(stock["sector"] for stock in stocks.values() if "sector" in stock)
+        )
+        self.first_keys = [
+            key for key, stock in stocks.items() if stock["priority"] == 1
+        ]
+        self.rest = [key for key, stock in stocks.items() if stock["priority"] != 1]
+        self.page = None
+        self.rows = {}
+        self.index.build(
+            stocks,
+            {
+                key: price_feed.price_change(
+                    float(stock["price"]), float(stock["starting_price"])
+                )
+                for key, stock in stocks.items()
+            },
+        )
+        self.search.build(stocks)
+        self.search_stale = False
+
+    # Applies a changed stock document (as read by the price feed)
+    def update(self, doc):
+        key = "stock:" + doc["symbol"]
+        if key not in self.stocks:
+            return
+        stock = self.stocks[key]
+        searchable = False
+        for field in ("price", "company", "starting_price"):
+            if field in doc and stock.get(field) != doc[field]:
+                stock[field] = doc[field]
+                self.rows.pop(key, None)
+                searchable = searchable or field == "company"
+        if "sector" in doc and stock.get("sector") != doc["sector"]:
+            searchable = True
+            stock["sector"] = doc["sector"]
+            self.index.move(key, doc["sector"])
+            self.sectors = sorted(
+                sector
+                for sector, keys in self.index.sectors.items()
+                if keys and sector is not None
+            )
+            self.page = None
+        if searchable:
+            self.search_stale = True
+            self.version += 1
+        self.index.set_change(
+            key,
+            price_feed.price_change(
+                float(stock["price"]), float(stock["starting_price"])
+            ),
+        )
+
+    def find(self, query):
+        if self.search_stale:
+            self.search.build(self.stocks)
+            self.search_stale = False
+        return self.search.search(query)
+
+    def render_page(self, handler):
+        if self.page is None:
+            page = handler.render_string(
+                "www/exchange.html", sectors=self.sectors, rows=ROWS_MARKER
+            )
+            self.page = page.split(ROWS_MARKER.encode())
+        first_keys = list(self.first_keys)
+        rest = list(self.rest)
+        random.shuffle(first_keys)
+        random.shuffle(rest)
+        rows = []
+        for key in first_keys + rest:
+            if key not in self.rows:
+                self.rows[key] = handler.render_string(
+                    "www/stock_row.html", key=key, stock=self.stocks[key]
+                )
+            rows.append(self.rows[key])
+        return self.page[0] + b"".join(rows) + self.page[1]
@@ -1,12 +1,17 @@
 #!/usr/bin/env - python
+import time
 
 import tornado.escape
 import tornado.gen
 import tornado.httpclient
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+import tornado.ioloop
+from tornado.httpclient import HTTPRequest
 
 # from txcouchbase.bucket import Bucket
 
+import broadcast
+import fts_client
+import metrics
 import settings
 
 BOOTSTRAP_NODES = settings.CLUSTER_NODES
@@ -16,6 +21,8 @@ INDEX_URL = "/indexStatus"
 SERVICE_URL = "/pools/default/nodeServices"
 FTS_URL = "/api/index/cbex"
 XDCR_URL = "/pools/default/remoteClusters"
+# Long-polled: answers once the cluster configuration's etag moves on
+POOL_URL = "/pools/default?waitChange={}&etag={}"
 USERNAME = settings.ADMIN_USER
 PASSWORD = settings.ADMIN_PASS
 
@@ -30,7 +37,22 @@ aws = settings.AWS
 #                 username=user,
 #                 password=password)
 
-http_client = AsyncHTTPClient()
+URL_SECONDS = metrics.Histogram(
+    "cbex_cluster_status_seconds",
+    "Management API request time by host and endpoint",
+    ["host", "endpoint"],
+)
+URL_ERRORS = metrics.Counter(
+    "cbex_cluster_status_errors_total",
+    "Failed management API requests by host and endpoint",
+    ["host", "endpoint"],
+)
+
+# One keep-alive pool of connections to the management port of every node,
+# shared by all the status requests (see fts_client.PooledHTTPClient)
+http_client = fts_client.PooledHTTPClient(
+    force_instance=True, max_clients=settings.CB_STATUS_POOL_SIZE
+)
 
 
 def get_image_for_product(product):
@@ -39,7 +61,7 @@ def get_image_for_product(product):
 
 
 @tornado.gen.coroutine
-def get_url(endpoint, host_list=BOOTSTRAP_NODES, raise_exception=False):
+def get_url(endpoint, host_list=BOOTSTRAP_NODES, raise_exception=False, timeout=0.3):
     exceptions = []
     while True:
         for host in host_list:
@@ -50,14 +72,19 @@ def get_url(endpoint, host_list=BOOTSTRAP_NODES, raise_exception=False):
                 auth_username=USERNAME,
                 auth_password=PASSWORD,
                 auth_mode="basic",
-                request_timeout=0.3,
+                request_timeout=timeout,
             )
+            # Long poll URLs carry an etag; only the path makes a useful label
+            labels = (host, endpoint.split("?")[0])
+            start = time.time()
             try:
                 response = yield http_client.fetch(request)
+                URL_SECONDS.labels(*labels).observe(time.time() - start)
                 raise tornado.gen.Return(
                     (tornado.escape.json_decode(response.body), host)
                 )
             except tornado.httpclient.HTTPError as e:
+                URL_ERRORS.labels(*labels).inc()
                 print(("Could not retrieve URL: " + str(target_url) + str(e)))
                 exceptions.append(e)
 
@@ -147,9 +174,11 @@ def fts_nodes():
     raise tornado.gen.Return(fts_nodes)
 
 
+# Pass the FTS nodes in if they have already been fetched this round
 @tornado.gen.coroutine
-def fts_enabled():
-    nodes_to_query = yield fts_nodes()
+def fts_enabled(nodes_to_query=None):
+    if nodes_to_query is None:
+        nodes_to_query = yield fts_nodes()
     nodes_to_query = ["{}:8094".format(node) for node in nodes_to_query]
     if not nodes_to_query:
         raise tornado.gen.Return(False)
@@ -180,3 +209,104 @@ def xdcr_enabled():
         raise tornado.gen.Return(True)
     xdcr_response, _ = yield get_url(XDCR_URL)
     raise tornado.gen.Return(len(xdcr_response) > 0)
+
+
+# Keeps one versioned snapshot of the cluster status for the whole app. Node
+# status (which carries live ops counts) is fetched every round; index, XDCR
+# and FTS status only every CB_STATUS_SLOW_INTERVAL seconds, or straight
+# away when a long poll on the cluster configuration says the topology has
+# changed. Independent fetches run concurrently and the FTS node list is
+# fetched once per round. Listeners only hear about snapshots that differ.
+class ClusterStatus(object):
+    def __init__(self):
+        self.version = 0
+        self.snapshot = {
+            "nodes": [],
+            "fts_nodes": [],
+            "fts": False,
+            "n1ql": False,
+            "xdcr": False,
+        }
+        self.encoded = None
+        self.listeners = []
+        self.etag = ""
+        self.topology_changed = True
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def publish(self, snapshot):
+        if snapshot == self.snapshot:
+            return
+        self.snapshot = snapshot
+        self.version += 1
+        self.encoded = None
+        for listener in list(self.listeners):
+            listener()
+
+    # The message the node status sockets send, encoded once per version
+    def payload(self):
+        if self.encoded is None:
+            self.encoded = broadcast.encode(
+                {
+                    "nodes": self.snapshot["nodes"],
+                    "fts": self.snapshot["fts"],
+                    "search": self.snapshot["fts"]
+                    or settings.SEARCH_BACKEND == "local",
+                    "n1ql": self.snapshot["n1ql"],
+                    "xdcr": self.snapshot["xdcr"],
+                }
+            )
+        return self.encoded
+
+    @tornado.gen.coroutine
+    def refresh(self, slow):
+        fetches = {"nodes": get_node_status()}
+        if slow:
+            fetches["n1ql"] = n1ql_enabled()
+            fetches["xdcr"] = xdcr_enabled()
+            fetches["fts_nodes"] = fts_nodes()
+        results = yield fetches
+        if slow:
+            results["fts"] = yield fts_enabled(results["fts_nodes"])
+        self.publish(dict(self.snapshot, **results))
+
+    @tornado.gen.coroutine
+    def watch_topology(self):
+        wait = settings.CB_STATUS_LONG_POLL
+        while True:
+            try:
+                response, _ = yield get_url(
+                    POOL_URL.format(wait * 1000, self.etag),
+                    raise_exception=True,
+                    timeout=wait + 5,
+                )
+            except Exception:
+                yield tornado.gen.sleep(1)
+                continue
+            if response.get("etag", self.etag) != self.etag:
+                self.etag = response.get("etag")
+                self.topology_changed = True
+
+    @tornado.gen.coroutine
+    def run(self):
+        if aws:
+            tornado.ioloop.IOLoop.current().spawn_callback(self.watch_topology)
+        last_slow = 0
+        while True:
+            slow = (
+                self.topology_changed
+                or time.time() - last_slow >= settings.CB_STATUS_SLOW_INTERVAL
+            )
+            if slow:
+                self.topology_changed = False
+                last_slow = time.time()
+            try:
+                yield self.refresh(slow)
+            except Exception as e:
+                print(e)
+            yield tornado.gen.sleep(settings.CB_STATUS_INTERVAL)
@@ -1,10 +1,14 @@
 #!/usr/bin/env - python
 
+import datetime
 import json
+import random
 import sys
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import requests
+import tornado.options
 from requests.auth import HTTPBasicAuth
 
 from datetime import timedelta
@@ -17,7 +21,10 @@ from couchbase.collection import Collection
 # needed for options -- cluster, timeout, SQL++ (N1QL) query, etc.
 from couchbase.options import ClusterOptions
 
-from couchbase.management.options import CreatePrimaryQueryIndexOptions
+from couchbase.management.options import (
+    CreatePrimaryQueryIndexOptions,
+    CreateQueryIndexOptions,
+)
 from couchbase.management.logic.buckets_logic import CreateBucketSettings
 from couchbase.management.queries import QueryIndexManager
 
@@ -35,6 +42,32 @@ timeout = settings.TIMEOUT
 bucket_ram_quota = settings.BUCKET_RAM_QUOTA
 fts_index_name = settings.FTS_INDEX_NAME
 
+# Parsed separately from tornado.options.options, so other scripts can import
+# this one without their option names clashing
+options = tornado.options.OptionParser()
+options.define(
+    "input", default=settings.STOCKS_FILE, help="stocks file, as JSON or NDJSON"
+)
+options.define(
+    "stocks", default=settings.NUM_STOCKS, help="most stocks to load from the file"
+)
+options.define(
+    "synthetic_stocks", default=0, help="load this many made up stocks instead"
+)
+options.define("orders", default=0, help="made up orders to load")
+options.define("seed", default=1, help="seed for the made up documents")
+options.define(
+    "batch_size", default=settings.LOAD_BATCH_SIZE, help="documents per upsert batch"
+)
+options.define(
+    "concurrency", default=settings.LOAD_CONCURRENCY, help="batches written at once"
+)
+options.define(
+    "skip_setup",
+    default=False,
+    help="only load documents, without creating the bucket and indexes",
+)
+
 
 def admin_create_bucket(cluster: Cluster):
     try:
@@ -69,6 +102,20 @@ def add_indexes(index_manager: QueryIndexManager):
             options=CreatePrimaryQueryIndexOptions(ignore_if_exists=True),
         )
 
+        # Lets the app's price delta query (queries.PRICE_CHANGES) range scan
+        # the stocks changed since its CAS cursor, rather than scan and fetch
+        # every document each tick
+        print("Creating stock CAS index on {0}...".format(bucket_name))
+        index_manager.create_index(
+            bucket_name,
+            "stock_cas",
+            ["META().cas"],
+            CreateQueryIndexOptions(
+                ignore_if_exists=True,
+                condition="symbol IS NOT MISSING AND price IS NOT MISSING",
+            ),
+        )
+
         print("Indexes created successfully!")
     except:
         print(
@@ -78,23 +125,198 @@ def add_indexes(index_manager: QueryIndexManager):
         )
 
 
-def add_stocks(default_collection: Collection):
+# Yields the documents in a JSON array or NDJSON file a chunk at a time, so
+# the whole file never has to be in memory
+def read_documents(path, chunk_size=1 << 16):
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buffer = f.read(chunk_size).lstrip()
+        in_array = buffer.startswith("[")
+        if in_array:
+            buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip()
+            if in_array:
+                buffer = buffer.lstrip(",").lstrip()
+                if buffer.startswith("]"):
+                    return
+            try:
+                doc, end = decoder.raw_decode(buffer)
+            except ValueError:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    if buffer:
+                        raise
+                    return
+                buffer += chunk
+                continue
+            yield doc
+            buffer = buffer[end:]
+
+
+COMPANY_WORDS = (
+    "Acme Apex Atlas Blue Bright Cedar Delta Eagle Echo First Global Granite "
+    "Harbor Iron Lunar Metro Nova Oak Pacific Peak Pioneer Prime Quantum River "
+    "Silver Solar Summit Union Vertex"
+).split()
+COMPANY_SUFFIXES = ("Corp", "Inc.", "Group", "Holdings", "Systems", "Labs")
+SECTORS = (
+    "Technology",
+    "Consumer",
+    "Finance",
+    "Health Care",
+    "Capital Goods",
+    "Miscellaneous",
+    "Transportation",
+    "Public Utilities",
+)
+INVESTOR_NAMES = (
+    "Alex Charlie Dana Eli Frankie Gray Harper Jamie Kai Lee Morgan Noel "
+    "Pat Quinn Riley Sam Taylor Val"
+).split()
+# Orders split evenly between the geos the geo leaderboard reads
+GEOS = ("USA", "EU", None)
+# Made up orders end here rather than now, so every run writes the same keys
+ORDERS_END = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+
+# N made up stocks, always the same ones for the same seed
+def synthetic_stocks(count, seed):
+    rng = random.Random(seed)
+    for i in range(count):
+        symbol = ""
+        n = i
+        for _ in range(4):
+            symbol = chr(ord("A") + n % 26) + symbol
+            n //= 26
+        price = round(rng.uniform(5, 500), 2)
+        yield {
+            "symbol": "S" + symbol,
+            "company": "{} {} {}".format(
+                rng.choice(COMPANY_WORDS),
+                rng.choice(COMPANY_WORDS),
+                rng.choice(COMPANY_SUFFIXES),
+            ),
+            "sector": rng.choice(SECTORS),
+            "price": price,
+            "starting_price": price,
+            "priority": 1 if i < 8 else 2,
+        }
+
+
+# M made up orders of five stocks each, shaped like the ones SubmitHandler
+# writes and spread over the `days` before ORDERS_END, oldest first
+def synthetic_orders(count, stocks, seed, days=30):
+    rng = random.Random(seed)
+    start = ORDERS_END - days * 86400
+    step = days * 86400.0 / max(count, 1)
+    for i in range(count):
+        ts = start + i * step
+        name = "{} {}".format(rng.choice(INVESTOR_NAMES), rng.randrange(100000))
+        order = []
+        for stock in rng.sample(stocks, 5):
+            purchase_price = float(stock["price"])
+            order.append(
+                {
+                    "symbol": stock["symbol"],
+                    "purchase_price": purchase_price,
+                    "quantity": 100.0 / purchase_price,
+                }
+            )
+        doc = {"name": name, "order": order, "ts": int(ts), "type": "order"}
+        geo = GEOS[i % len(GEOS)]
+        if geo is not None:
+            doc["geo"] = geo
+        when = datetime.datetime.utcfromtimestamp(ts)
+        key = "Order::{}::{}".format(name, when.isoformat(timespec="microseconds"))
+        yield key, doc
+
+
+# Upserts (key, document) pairs in batches, with at most `concurrency`
+# batches in flight, printing progress as it goes
+class BulkLoader(object):
+    def __init__(
+        self,
+        collection: Collection,
+        batch_size=settings.LOAD_BATCH_SIZE,
+        concurrency=settings.LOAD_CONCURRENCY,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(concurrency)
+        self.concurrency = concurrency
+        self.in_flight = set()
+        self.loaded = 0
+        self.failed = 0
+        self.start = None
+        self.reported = 0
+
+    def write(self, batch):
+        try:
+            result = self.collection.upsert_multi(batch)
+        except Exception as e:
+            print(e)
+            return len(batch), len(batch)
+        errors = result.exceptions or {}
+        for key, error in list(errors.items())[:3]:
+            print(("{}: {}").format(key, error))
+        return len(batch), len(errors)
+
+    def collect(self, futures):
+        for future in futures:
+            written, failed = future.result()
+            self.loaded += written - failed
+            self.failed += failed
+        self.in_flight -= futures
+        now = time.time()
+        if now - self.reported >= settings.LOAD_REPORT_INTERVAL:
+            self.report(now)
+
+    def report(self, now):
+        self.reported = now
+        print(
+            ("{} docs loaded, {} failed, {:.0f} docs/s").format(
+                self.loaded, self.failed, self.loaded / max(now - self.start, 1e-9)
+            )
+        )
+
+    def submit(self, batch):
+        if len(self.in_flight) >= self.concurrency:
+            done, _ = wait(self.in_flight, return_when=FIRST_COMPLETED)
+            self.collect(done)
+        self.in_flight.add(self.executor.submit(self.write, batch))
+
+    def load(self, pairs):
+        if self.start is None:
+            self.start = self.reported = time.time()
+        batch = {}
+        for key, doc in pairs:
+            batch[key] = doc
+            if len(batch) == self.batch_size:
+                self.submit(batch)
+                batch = {}
+        if batch:
+            self.submit(batch)
+        self.collect(set(wait(self.in_flight).done))
+        self.report(time.time())
+
+
+def add_stocks(loader: BulkLoader, stocks, limit=None):
     print("Loading dataset...")
-    # https://www.nasdaq.com/screening/companies-by-name.aspx?letter=0&exchange=nasdaq&render=download
-    stocks_json = open(settings.STOCKS_FILE, "r")
-    stocks_dict = json.load(stocks_json)
     symbol_list = []
-    stock_count = 0
-    for stock_doc in stocks_dict:
-        if stock_count >= settings.NUM_STOCKS:
-            break
-        if "priority" not in stock_doc:
-            stock_doc["priority"] = 2
-        stock_key = "stock:" + stock_doc["symbol"]
-        symbol_list.append(stock_key)
-        default_collection.upsert(stock_key, stock_doc)
-        stock_count += 1
-    default_collection.upsert(settings.PRODUCT_LIST, {"symbols": symbol_list})
+
+    def pairs():
+        for stock_doc in stocks:
+            if limit is not None and len(symbol_list) >= limit:
+                break
+            if "priority" not in stock_doc:
+                stock_doc["priority"] = 2
+            stock_key = "stock:" + stock_doc["symbol"]
+            symbol_list.append(stock_key)
+            yield stock_key, stock_doc
+
+    loader.load(pairs())
+    loader.collection.upsert(settings.PRODUCT_LIST, {"symbols": symbol_list})
     print("Successfully populated dataset!")
 
 
@@ -122,6 +344,8 @@ def add_fts_indexes():
 
 
 if __name__ == "__main__":
+    options.parse_command_line()
+
     # Connect options - authentication
     auth = PasswordAuthenticator(
         user,
@@ -134,15 +358,29 @@ if __name__ == "__main__":
     # Wait until the cluster is ready for use.
     cluster.wait_until_ready(timedelta(seconds=5))
 
-    admin_create_bucket(cluster)
+    if not options.skip_setup:
+        admin_create_bucket(cluster)
 
-    # Workaround wait_ready is not enough...
-    time.sleep(timeout)
+        # Workaround wait_ready is not enough...
+        time.sleep(timeout)
 
     bucket = cluster.bucket(bucket_name)
-    add_stocks(bucket.default_collection())
+    loader = BulkLoader(
+        bucket.default_collection(), options.batch_size, options.concurrency
+    )
+    if options.synthetic_stocks:
+        stocks = list(synthetic_stocks(options.synthetic_stocks, options.seed))
+        add_stocks(loader, stocks)
+    else:
+        add_stocks(loader, read_documents(options.input), options.stocks)
+    if options.orders:
+        if not options.synthetic_stocks:
+            stocks = list(read_documents(options.input))[: options.stocks]
+        print(("Loading {} orders...").format(options.orders))
+        loader.load(synthetic_orders(options.orders, stocks, options.seed))
 
-    index_manager = cluster.query_indexes()
-    add_indexes(index_manager)
+    if not options.skip_setup:
+        index_manager = cluster.query_indexes()
+        add_indexes(index_manager)
 
-    add_fts_indexes()
+        add_fts_indexes()
@@ -0,0 +1,105 @@
+#!/usr/bin/env - python
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.gen
+import tornado.locks
+import tornado.web
+
+import metrics
+import settings
+
+CALL_SECONDS = metrics.Histogram(
+    "cbex_db_call_seconds",
+    "Time Couchbase calls spend running, by kind (kv, query) and name",
+    ["kind", "name"],
+)
+WAIT_SECONDS = metrics.Histogram(
+    "cbex_db_wait_seconds",
+    "Time Couchbase calls wait for a free slot, by kind and name",
+    ["kind", "name"],
+)
+CALL_ERRORS = metrics.Counter(
+    "cbex_db_errors_total",
+    "Couchbase calls that raised, by kind and name",
+    ["kind", "name"],
+)
+REFUSED = metrics.Counter(
+    "cbex_db_refused_total", "Couchbase calls refused because the queue was full"
+)
+
+
+# Raised instead of queueing more work once max_pending calls are waiting.
+# Handlers let it through and the client gets a 503.
+class Overloaded(tornado.web.HTTPError):
+    def __init__(self):
+        super(Overloaded, self).__init__(503, "Data access queue is full")
+
+
+# Runs the blocking Couchbase SDK calls on a bounded pool of threads so they
+# never hold up the IOLoop. At most `concurrency` calls are in flight; up to
+# `max_pending` more wait their turn, and anything beyond that is refused.
+# Query rows are read inside the worker too, since iterating a result is
+# where the SDK actually waits on the network.
+class DataAccess(object):
+    def __init__(
+        self,
+        cluster,
+        collection,
+        concurrency=settings.DB_CONCURRENCY,
+        max_pending=settings.DB_MAX_PENDING,
+    ):
+        self.cluster = cluster
+        self.collection = collection
+        self.executor = ThreadPoolExecutor(concurrency)
+        self.slots = tornado.locks.Semaphore(concurrency)
+        self.max_pending = max_pending
+        self.pending = 0
+        metrics.Collected(
+            "cbex_db_pending",
+            "Couchbase calls running or waiting for a slot",
+            [],
+            lambda: {(): self.pending},
+        )
+
+    # Runs fn on the pool, timed under `kind` and `name`
+    @tornado.gen.coroutine
+    def call(self, kind, name, fn, *args, **kwargs):
+        if self.pending >= self.max_pending:
+            REFUSED.labels().inc()
+            raise Overloaded()
+        self.pending += 1
+        queued = time.time()
+        try:
+            with (yield self.slots.acquire()):
+                started = time.time()
+                WAIT_SECONDS.labels(kind, name).observe(started - queued)
+                try:
+                    result = yield self.executor.submit(fn, *args, **kwargs)
+                except Exception:
+                    CALL_ERRORS.labels(kind, name).inc()
+                    raise
+                finally:
+                    CALL_SECONDS.labels(kind, name).observe(time.time() - started)
+        finally:
+            self.pending -= 1
+        raise tornado.gen.Return(result)
+
+    # Runs one of the statements in queries.py, timed under its name
+    def execute(self, statement, *positional, **named):
+        return self.call(
+            "query", statement.name, statement.rows, self.cluster, *positional, **named
+        )
+
+    def get(self, key, *options, **kwargs):
+        return self.call("kv", "get", self.collection.get, key, *options, **kwargs)
+
+    def get_multi(self, keys, *options, **kwargs):
+        return self.call(
+            "kv", "get_multi", self.collection.get_multi, keys, *options, **kwargs
+        )
+
+    def upsert_multi(self, docs, *options, **kwargs):
+        return self.call(
+            "kv", "upsert_multi", self.collection.upsert_multi, docs, *options, **kwargs
+        )
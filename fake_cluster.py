@@ -0,0 +1,197 @@
+#!/usr/bin/env - python
+# In-memory stand-in for the parts of the Couchbase SDK the app uses: key-value
+# get/get_multi/upsert/upsert_multi/mutate_in, and the handful of N1QL
+# statements it sends, answered by shape rather than parsed. Documents go
+# through JSON on the way in and out, like they would over the wire. Good
+# enough to load test the app without a cluster; nothing more.
+
+import bisect
+import itertools
+import json
+import threading
+
+from couchbase.exceptions import DocumentNotFoundException
+from couchbase.subdocument import SubDocOp
+
+
+class Result(object):
+    def __init__(self, key, value=None, cas=None):
+        self.key = key
+        self.value = value
+        self.cas = cas
+
+
+class MultiResult(object):
+    def __init__(self, results, exceptions):
+        self.results = results
+        self.exceptions = exceptions
+        self.all_ok = not exceptions
+
+
+class QueryResult(object):
+    def __init__(self, rows):
+        self._rows = rows
+
+    def rows(self):
+        return iter(self._rows)
+
+
+class FakeCollection(object):
+    def __init__(self):
+        self.docs = {}
+        self.lock = threading.Lock()
+        self.sequence = itertools.count(1)
+        # (ts, key) of every order, so they can be paged the way the app does
+        self.orders = []
+
+    def store(self, key, value):
+        doc = json.loads(json.dumps(value))
+        cas = next(self.sequence)
+        if doc.get("type") == "order" and key not in self.docs:
+            bisect.insort(self.orders, (doc["ts"], key))
+        self.docs[key] = (doc, cas)
+        return cas
+
+    def get(self, key, *options, **kwargs):
+        with self.lock:
+            if key not in self.docs:
+                raise DocumentNotFoundException()
+            doc, cas = self.docs[key]
+            return Result(key, json.loads(json.dumps(doc)), cas)
+
+    def get_multi(self, keys, *options, **kwargs):
+        results = {}
+        exceptions = {}
+        for key in keys:
+            try:
+                results[key] = self.get(key)
+            except DocumentNotFoundException as e:
+                exceptions[key] = e
+        return MultiResult(results, exceptions)
+
+    def upsert(self, key, value, *options, **kwargs):
+        with self.lock:
+            return Result(key, cas=self.store(key, value))
+
+    def upsert_multi(self, docs, *options, **kwargs):
+        return MultiResult(
+            {key: self.upsert(key, value) for key, value in docs.items()}, {}
+        )
+
+    def mutate_in(self, key, specs, *options, **kwargs):
+        with self.lock:
+            if key not in self.docs:
+                raise DocumentNotFoundException()
+            doc = json.loads(json.dumps(self.docs[key][0]))
+            for spec in specs:
+                if spec[0] not in (SubDocOp.DICT_UPSERT, SubDocOp.REPLACE):
+                    raise NotImplementedError(spec)
+                target = doc
+                path = spec[1].split(".")
+                for part in path[:-1]:
+                    target = target.setdefault(part, {})
+                target[path[-1]] = spec[-1]
+            return Result(key, cas=self.store(key, doc))
+
+
+class FakeBucket(object):
+    def __init__(self, collection):
+        self.collection = collection
+
+    def default_collection(self):
+        return self.collection
+
+
+class FakeCluster(object):
+    def __init__(self):
+        self.collection = FakeCollection()
+
+    def bucket(self, name):
+        return FakeBucket(self.collection)
+
+    def wait_until_ready(self, *args, **kwargs):
+        pass
+
+    def query(self, statement, *options, **kwargs):
+        params = []
+        for option in options:
+            params = option.get("positional_parameters", params)
+        with self.collection.lock:
+            if "META().cas AS cas" in statement:
+                rows = self.prices(params[0] if "$1" in statement else None)
+            elif "doc.type='order'" in statement:
+                rows = self.orders(*params)
+            elif "UNNEST doc.`order`" in statement:
+                rows = self.investments()
+            elif "LET price_diff" in statement:
+                rows = self.performance("DESC" in statement)
+            else:
+                raise NotImplementedError(statement)
+        return QueryResult(rows)
+
+    def prices(self, cursor):
+        rows = []
+        for doc, cas in self.collection.docs.values():
+            if "symbol" not in doc or "price" not in doc:
+                continue
+            if cursor is not None and cas <= cursor:
+                continue
+            row = {
+                field: doc[field]
+                for field in ("symbol", "company", "sector", "price", "starting_price")
+                if field in doc
+            }
+            row["cas"] = cas
+            rows.append(row)
+        return rows
+
+    def orders(self, origin, ts, key, limit=50):
+        rows = []
+        start = bisect.bisect_right(self.collection.orders, (ts, key))
+        for ts, key in self.collection.orders[start:]:
+            doc = self.collection.docs[key][0]
+            if doc.get("origin") == origin:
+                continue
+            rows.append(json.loads(json.dumps(dict(doc, id=key))))
+            if len(rows) == limit:
+                break
+        return rows
+
+    def investments(self):
+        rows = []
+        for doc, _ in self.collection.docs.values():
+            if doc.get("type") != "order":
+                continue
+            if doc.get("geo", "USA") not in ("USA", "EU"):
+                continue
+            for stock in doc["order"]:
+                rows.append(
+                    {
+                        "symbol": stock["symbol"],
+                        "name": doc["name"],
+                        "purchase_price": stock["purchase_price"],
+                        "quantity": stock["quantity"],
+                        "geo": doc.get("geo", "Unknown"),
+                    }
+                )
+        rows.sort(key=lambda row: row["symbol"])
+        return rows
+
+    def performance(self, best, limit=10):
+        rows = []
+        for doc, _ in self.collection.docs.values():
+            if "symbol" not in doc:
+                continue
+            price = doc["price"]
+            starting_price = doc["starting_price"]
+            rows.append(
+                {
+                    "price_diff": 100 * (price - starting_price) / starting_price,
+                    "symbol": doc["symbol"],
+                    "company": doc.get("company"),
+                    "starting_price": starting_price,
+                    "price": price,
+                }
+            )
+        rows.sort(key=lambda row: row["price_diff"], reverse=best)
+        return rows[:limit]
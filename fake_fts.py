@@ -0,0 +1,72 @@
+#!/usr/bin/env - python
+# Stand-in for an FTS node's query API, answering from the local search index
+# over the stocks file. Latency and failures can be injected so the FTS client
+# can be exercised without a cluster:
+#
+#   $ python fake_fts.py --port=9094 --delay=0.05 --fail_rate=0.1
+
+import json
+import random
+import urllib.parse
+
+import tornado.escape
+import tornado.gen
+import tornado.ioloop
+import tornado.options
+import tornado.web
+
+import search
+import settings
+
+tornado.options.define("port", default=9094, help="port to listen on")
+tornado.options.define("delay", default=0.0, help="seconds to wait before answering")
+tornado.options.define("fail_rate", default=0.0, help="fraction of queries to fail")
+
+
+class QueryHandler(tornado.web.RequestHandler):
+    def initialize(self, index, delay, fail_rate):
+        self.index = index
+        self.delay = delay
+        self.fail_rate = fail_rate
+
+    @tornado.gen.coroutine
+    def post(self, index_name):
+        if self.delay:
+            yield tornado.gen.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            self.send_error(500)
+            return
+        body = tornado.escape.json_decode(self.request.body)
+        text = urllib.parse.unquote(body["query"]["query"]).replace("~1", "")
+        keys = self.index.search(text)
+        self.write(
+            {
+                "status": {"total": 1, "failed": 0, "successful": 1},
+                "hits": [{"index": index_name, "id": key, "score": 1} for key in keys],
+                "total_hits": len(keys),
+            }
+        )
+
+
+def make_app(stocks, delay=0.0, fail_rate=0.0):
+    index = search.SearchIndex()
+    index.build({"stock:" + stock["symbol"]: stock for stock in stocks})
+    return tornado.web.Application(
+        [
+            (
+                r"/api/index/([^/]+)/query",
+                QueryHandler,
+                {"index": index, "delay": delay, "fail_rate": fail_rate},
+            )
+        ]
+    )
+
+
+if __name__ == "__main__":
+    tornado.options.parse_command_line()
+    options = tornado.options.options
+    with open(settings.STOCKS_FILE, "r") as stocks_json:
+        stocks = json.load(stocks_json)
+    make_app(stocks, options.delay, options.fail_rate).listen(options.port)
+    print(("Fake FTS running at http://localhost:{}").format(options.port))
+    tornado.ioloop.IOLoop.current().start()
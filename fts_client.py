@@ -0,0 +1,188 @@
+#!/usr/bin/env - python
+import collections
+import datetime
+import time
+import urllib.parse
+
+import tornado.escape
+import tornado.gen
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPRequest
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+
+import settings
+
+# libcurl keeps connections alive between requests. pycurl is in
+# requirements.txt; without it we fall back to Tornado's own client, which
+# opens a connection per request
+try:
+    import pycurl  # noqa: F401
+    from tornado.curl_httpclient import CurlAsyncHTTPClient as PooledHTTPClient
+except ImportError:
+    PooledHTTPClient = SimpleAsyncHTTPClient
+
+FTS_PORT = 8094
+QUERY_URL = "http://{}/api/index/{}/query"
+
+
+def node_address(node):
+    return node if ":" in node else "{}:{}".format(node, FTS_PORT)
+
+
+# One FTS node: its own connection pool plus the latency and health figures
+# the client routes on
+class Node(object):
+    def __init__(self, name):
+        self.name = name
+        self.address = node_address(name)
+        self.http_client = PooledHTTPClient(
+            force_instance=True, max_clients=settings.FTS_POOL_SIZE
+        )
+        self.latency = None
+        self.outstanding = 0
+        self.failures = 0
+        self.evicted_until = 0
+
+    # Lower is better: expected latency scaled by the queue already waiting
+    def cost(self):
+        return (self.latency or 0) * (self.outstanding + 1)
+
+    def record(self, elapsed):
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            alpha = settings.FTS_EWMA_ALPHA
+            self.latency = alpha * elapsed + (1 - alpha) * self.latency
+        self.failures = 0
+
+    def fail(self):
+        self.failures += 1
+        if self.failures >= settings.FTS_MAX_FAILURES:
+            self.evicted_until = time.time() + settings.FTS_EVICT_SECONDS
+            self.failures = 0
+            print(("Evicting FTS node {}").format(self.name))
+
+
+# The same query sent to one or more nodes. `winner` resolves with the first
+# attempt to succeed, or the last error once every attempt has failed.
+class Race(object):
+    def __init__(self):
+        self.winner = Future()
+        self.attempts = []
+
+    def add(self, attempt):
+        self.attempts.append(attempt)
+        attempt.add_done_callback(self.settle)
+
+    def running(self):
+        return sum(1 for attempt in self.attempts if not attempt.done())
+
+    def settle(self, attempt):
+        if self.winner.done():
+            return
+        if attempt.exception() is None:
+            self.winner.set_result(attempt.result())
+        elif not self.running():
+            self.winner.set_exception(attempt.exception())
+
+
+# Client for the FTS query API. Each request goes to the node with the lowest
+# EWMA latency times outstanding requests; if it hasn't answered within the
+# p95 of recent latencies a hedged copy goes to the next best node, and the
+# first good answer wins. Nodes that keep failing are evicted for a while.
+class FTSClient(object):
+    def __init__(self, index=settings.FTS_INDEX_NAME):
+        self.index = index
+        self.nodes = {}
+        self.latencies = collections.deque(maxlen=settings.FTS_LATENCY_WINDOW)
+
+    def set_nodes(self, names):
+        for name in names:
+            if name not in self.nodes:
+                self.nodes[name] = Node(name)
+        for name in list(self.nodes):
+            if name not in names:
+                self.nodes.pop(name).http_client.close()
+
+    def candidates(self):
+        now = time.time()
+        nodes = [node for node in self.nodes.values() if node.evicted_until <= now]
+        # If everything has been evicted, trying a node beats failing outright
+        return sorted(nodes or self.nodes.values(), key=lambda node: node.cost())
+
+    def budget(self):
+        if len(self.latencies) < settings.FTS_LATENCY_WINDOW // 10:
+            return settings.FTS_HEDGE_DEFAULT
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95)]
+
+    @tornado.gen.coroutine
+    def fetch(self, node, body):
+        request = HTTPRequest(
+            url=QUERY_URL.format(node.address, self.index),
+            method="POST",
+            body=body,
+            auth_username=settings.ADMIN_USER,
+            auth_password=settings.ADMIN_PASS,
+            auth_mode="basic",
+            headers={"Content-Type": "application/json"},
+            request_timeout=settings.FTS_TIMEOUT,
+        )
+        node.outstanding += 1
+        start = time.time()
+        try:
+            response = yield node.http_client.fetch(request)
+        except Exception:
+            node.fail()
+            raise
+        finally:
+            node.outstanding -= 1
+        elapsed = time.time() - start
+        node.record(elapsed)
+        self.latencies.append(elapsed)
+        raise tornado.gen.Return(tornado.escape.json_decode(response.body))
+
+    @tornado.gen.coroutine
+    def query(self, query):
+        nodes = self.candidates()
+        if not nodes:
+            raise Exception("No FTS node found")
+        body = tornado.escape.json_encode(
+            {
+                "query": {"query": query},
+                "highlight": None,
+                "fields": None,
+                "facets": None,
+                "explain": False,
+            }
+        )
+
+        race = Race()
+        race.add(self.fetch(nodes[0], body))
+        for node in nodes[1:]:
+            try:
+                yield tornado.gen.with_timeout(
+                    datetime.timedelta(seconds=self.budget()),
+                    race.winner,
+                    quiet_exceptions=(Exception,),
+                )
+                break
+            except tornado.gen.TimeoutError:
+                # Still waiting past the budget: hedge on the next best node
+                if race.running() > settings.FTS_MAX_HEDGES:
+                    break
+                race.add(self.fetch(node, body))
+            except Exception:
+                # Every attempt so far failed: try the next node straight away
+                race = Race()
+                race.add(self.fetch(node, body))
+        result = yield race.winner
+        raise tornado.gen.Return(result)
+
+    # The ids of the stocks matching each term of `text` within one edit
+    @tornado.gen.coroutine
+    def search(self, text):
+        text = urllib.parse.quote(text.replace('"', r""))
+        query = " ".join(["{}~1".format(term) for term in text.split()])
+        response = yield self.query(query)
+        raise tornado.gen.Return([hit["id"] for hit in response["hits"]])
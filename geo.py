@@ -0,0 +1,153 @@
+#!/usr/bin/env - python
+import numpy as np
+
+import orders
+
+GEOS = ["USA", "EU", "Unknown"]
+# Orders without a geo field are reported as Unknown
+UNKNOWN = "Unknown"
+# Every stock in an order was bought for this much
+STAKE = 100
+
+
+# Turns (symbol, name, purchase_price, quantity) tuples, sorted by symbol,
+# into the rows and grand total the geo leaderboard template expects
+def summarise(investments, price_data):
+    rows = []
+    grand_total = 0
+    for symbol, name, purchase_price, quantity in investments:
+        profit = (quantity * price_data[symbol]["price"]) - STAKE
+        rows.append(
+            {
+                "symbol": symbol,
+                "name": name,
+                "purchase_price": purchase_price,
+                "quantity": round(quantity, 2),
+                "profit": round(profit, 2),
+            }
+        )
+        grand_total += profit
+    return {"total": round(grand_total, 2), "investments": rows}
+
+
+# Groups the rows of the cold-cache query, which carry a geo column
+def group(rows, price_data):
+    investments = {}
+    for row in rows:
+        investments.setdefault(row["geo"], []).append(
+            (row["symbol"], row["name"], row["purchase_price"], row["quantity"])
+        )
+    return {
+        geo: summarise(investments[geo], price_data)
+        for geo in GEOS
+        if geo in investments
+    }
+
+
+# Per-geo totals kept as sums of quantity per symbol, indexed by the order
+# log's symbol ids, so adding an order touches its five holdings and a price
+# tick touches nothing: a geo's total is sum(quantity * price) - STAKE * n over
+# the holdings' price vector, which set_price keeps current one changed symbol
+# at a time. The investments themselves are only read, and sorted by symbol,
+# from the log's columns when /geo is rendered. Until the order ingest has
+# caught up with the bucket the aggregates are cold and the handler falls
+# back to a single grouped query.
+class GeoAggregates(object):
+    def __init__(self, holdings):
+        self.holdings = holdings
+        self.log = holdings.log
+        self.quantities = np.zeros((len(GEOS), 64))
+        self.counts = np.zeros(len(GEOS), dtype=np.int64)
+        self.warm = False
+
+    # Which of GEOS an order with the log's `geo_id` counts towards, if any.
+    # Only orders without a geo are Unknown, as in queries.GEO.
+    def geo_of(self, geo_id):
+        if geo_id == orders.NO_GEO:
+            return GEOS.index(UNKNOWN)
+        name = self.log.geos[geo_id]
+        if name in GEOS and name != UNKNOWN:
+            return GEOS.index(name)
+        return None
+
+    # Adds the order at `row` of the log
+    def add(self, row):
+        record = self.log.record(row)
+        geo = self.geo_of(record["geo"])
+        stocks = record["stocks"]
+        if geo is None or not stocks:
+            return
+        symbols = record["symbol"][:stocks]
+        if symbols.max() >= self.quantities.shape[1]:
+            self.quantities = np.pad(
+                self.quantities, ((0, 0), (0, 2 * len(self.log.symbols)))
+            )
+        np.add.at(self.quantities[geo], symbols, record["quantity"][:stocks])
+        self.counts[geo] += stocks
+
+    def totals(self):
+        self.holdings.fit()
+        known = min(self.quantities.shape[1], len(self.holdings.prices))
+        values = self.quantities[:, :known] @ self.holdings.prices[:known]
+        return values - STAKE * self.counts
+
+    # Every investment in `geo`, sorted by symbol, as columns: symbol ids,
+    # name ids, purchase prices and quantities
+    def investments(self, geo):
+        # By the log's geo id plus one, so that NO_GEO is at 0
+        geo_index = np.array(
+            [
+                -1 if index is None else index
+                for index in map(self.geo_of, range(-1, len(self.log.geos)))
+            ]
+        )
+        columns = ([], [], [], [])
+        for segment in self.log.segments():
+            held = geo_index[segment["geo"] + 1] == geo
+            held = held[:, None] & (
+                np.arange(orders.ORDER_WIDTH) < segment["stocks"][:, None]
+            )
+            columns[0].append(segment["symbol"][held])
+            columns[1].append(
+                np.broadcast_to(segment["name"][:, None], held.shape)[held]
+            )
+            columns[2].append(segment["purchase_price"][held])
+            columns[3].append(segment["quantity"][held])
+        symbols, names, purchase_prices, quantities = (
+            np.concatenate(column) for column in columns
+        )
+        ranks = np.argsort(np.argsort(self.log.symbols))
+        order = np.argsort(ranks[symbols], kind="stable")
+        return symbols[order], names[order], purchase_prices[order], quantities[order]
+
+    # The rows and grand total of each geo with investments, as the geo
+    # leaderboard template expects
+    def geo_data(self):
+        totals = self.totals()
+        prices = self.holdings.prices
+        geo_data = {}
+        for geo, name in enumerate(GEOS):
+            if not self.counts[geo]:
+                continue
+            symbols, names, purchase_prices, quantities = self.investments(geo)
+            profits = quantities * prices[symbols] - STAKE
+            geo_data[name] = {
+                "total": round(float(totals[geo]), 2),
+                "investments": [
+                    {
+                        "symbol": self.log.symbols[symbol],
+                        "name": self.log.names[investor],
+                        "purchase_price": purchase_price,
+                        "quantity": round(quantity, 2),
+                        "profit": round(profit, 2),
+                    }
+                    for symbol, investor, purchase_price, quantity, profit in zip(
+                        symbols.tolist(),
+                        names.tolist(),
+                        purchase_prices.tolist(),
+                        quantities.tolist(),
+                        profits.tolist(),
+                    )
+                ],
+            }
+        return geo_data
@@ -0,0 +1,60 @@
+#!/usr/bin/env - python
+import numpy as np
+
+
+# Values every portfolio in an OrderLog against a vector of prices indexed by
+# the log's symbol ids. Each record is a fixed-width row of symbol ids and
+# quantities, so revaluing everything is one gather and row sum per log
+# segment. Values stay in the log records and only get written back into the
+# order dicts that are actually read (the leaderboard extremes and newly added
+# orders).
+class Holdings(object):
+    def __init__(self, prices, log):
+        self.price_data = prices
+        self.log = log
+        self.prices = np.zeros(64)
+        self.known = 0
+
+    # Grows the price vector to cover every symbol the log has interned,
+    # seeding new ones from price_data
+    def fit(self):
+        symbols = self.log.symbols
+        if len(self.prices) < len(symbols):
+            self.prices = np.resize(self.prices, 2 * len(symbols))
+        for symbol_id in range(self.known, len(symbols)):
+            entry = self.price_data.get(symbols[symbol_id], {})
+            self.prices[symbol_id] = entry.get("price", 0)
+        self.known = len(symbols)
+
+    def set_price(self, symbol, price):
+        symbol_id = self.log.symbol_id(symbol)
+        self.fit()
+        self.prices[symbol_id] = price
+
+    def add(self, portfolio):
+        row = self.log.append(portfolio)
+        self.fit()
+        record = self.log.record(row)
+        record["value"] = record["quantity"] @ self.prices[record["symbol"]]
+        portfolio["current_value"] = float(record["value"])
+        return row
+
+    def revalue(self):
+        self.fit()
+        for segment in self.log.segments():
+            segment["value"] = np.einsum(
+                "ij,ij->i", segment["quantity"], self.prices[segment["symbol"]]
+            )
+
+    # The best and worst k portfolios by value, rebuilt from the log with
+    # current_value filled in
+    def extremes(self, k):
+        values = np.concatenate([segment["value"] for segment in self.log.segments()])
+        count = len(values)
+        if count <= 2 * k:
+            rows = np.arange(count)
+        else:
+            best = np.argpartition(values, count - k)[count - k :]
+            worst = np.argpartition(values, k)[:k]
+            rows = np.union1d(best, worst)
+        return [self.log.order(int(row)) for row in rows]
@@ -0,0 +1,46 @@
+#!/usr/bin/env - python
+import heapq
+
+import broadcast
+
+
+# Keeps the best and worst `size` entries by `key` so readers never have to
+# sort the whole collection. rebuild() is a single O(n log k) pass for when
+# every value has moved; add() merges one new entry in O(k). The encoded
+# message is cached until the standings change, so every socket shares it.
+class Leaderboard(object):
+    def __init__(self, size, key, worst_first=False):
+        self.size = size
+        self.key = key
+        self.worst_first = worst_first
+        self.best = []
+        self.worst = []
+        self.encoded = None
+
+    def rebuild(self, entries):
+        self.best = heapq.nlargest(self.size, entries, key=self.key)
+        self.worst = heapq.nsmallest(self.size, entries, key=self.key)
+        self.encoded = None
+
+    # For standings computed elsewhere: best descending, worst ascending
+    def set(self, best, worst):
+        self.best = best
+        self.worst = worst
+        self.encoded = None
+
+    def add(self, entry):
+        self.best = heapq.nlargest(self.size, self.best + [entry], key=self.key)
+        self.worst = heapq.nsmallest(self.size, self.worst + [entry], key=self.key)
+        self.encoded = None
+
+    # Worst performers are listed highest first, matching a descending sort,
+    # unless the board was asked to put the very worst first
+    def standings(self):
+        if self.worst_first:
+            return {"best": self.best, "worst": self.worst}
+        return {"best": self.best, "worst": self.worst[::-1]}
+
+    def payload(self):
+        if self.encoded is None:
+            self.encoded = broadcast.encode(self.standings())
+        return self.encoded
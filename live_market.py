@@ -1,9 +1,15 @@
 #!/usr/bin/env - python
-import random
-import time
+# Moves the stock prices in the bucket, like a (very) small market:
+#
+#   $ python live_market.py --tick_rate=4 --symbols=200 --volatility=0.01
 
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import timedelta
 
+import numpy as np
+import tornado.options
+
 # needed for any cluster connection
 from couchbase.auth import PasswordAuthenticator
 from couchbase.cluster import Cluster
@@ -12,50 +18,213 @@ import couchbase.subdocument as SD
 # needed for options -- cluster, timeout, SQL++ (N1QL) query, etc.
 from couchbase.options import ClusterOptions
 
+import price_board
+import price_feed
+import queries
 import settings
 
-bucket_name = settings.BUCKET_NAME
-user = settings.USERNAME
-password = settings.PASSWORD
-node = settings.CLUSTER_NODES[0]
-
-# Connect options - authentication
-auth = PasswordAuthenticator(
-    user,
-    password,
+# Parsed separately from tornado.options.options, so other scripts can import
+# this one without their option names clashing
+options = tornado.options.OptionParser()
+options.define(
+    "tick_rate", default=settings.MARKET_TICK_RATE, help="price ticks per second"
 )
-# Get a reference to our cluster
-# NOTE: For TLS/SSL connection use 'couchbases://<your-ip-address>' instead
-cluster = Cluster(f"couchbase://{node}", ClusterOptions(auth))
-
-# Wait until the cluster is ready for use.
-cluster.wait_until_ready(timedelta(seconds=15))
-
-while True:
-    try:
-        print(".")
-        result = cluster.query(
-            "SELECT symbol,price FROM {} WHERE symbol IS NOT MISSING AND price IS NOT MISSING".format(
-                bucket_name
-            )
+options.define("symbols", default=0, help="how many stocks to move (0 for all of them)")
+options.define(
+    "drift", default=settings.MARKET_DRIFT, help="expected return per second"
+)
+options.define(
+    "volatility",
+    default=settings.MARKET_VOLATILITY,
+    help="standard deviation of the return over one second",
+)
+options.define(
+    "concurrency",
+    default=settings.MARKET_CONCURRENCY,
+    help="batches of price updates written at once",
+)
+options.define("seed", default=None, type=int, help="random seed, for repeatable runs")
+options.define(
+    "board",
+    default=False,
+    help="also write prices to the price board, for app.py's board ingest mode",
+)
+
+# Our own stock never falls
+FLOOR_SYMBOLS = ("CBSE",)
+# Ticks of price paths generated at a time
+PATH_STEPS = 256
+
+
+# Geometric Brownian motion for every stock at once. Paths are drawn
+# PATH_STEPS ticks at a time as one matrix of log returns, so a tick is just a
+# row lookup however many stocks there are. Stocks in FLOOR_SYMBOLS never take
+# a downward step.
+class Market(object):
+    def __init__(self, symbols, prices, drift, volatility, dt, seed=None):
+        self.symbols = list(symbols)
+        self.prices = np.array(prices, dtype=np.float64)
+        self.drift = drift
+        self.volatility = volatility
+        self.dt = dt
+        self.floored = np.isin(self.symbols, FLOOR_SYMBOLS)
+        self.random = np.random.default_rng(seed)
+        self.path = None
+        self.step = PATH_STEPS
+
+    def generate(self):
+        shocks = self.random.standard_normal((PATH_STEPS, len(self.symbols)))
+        returns = (self.drift - self.volatility**2 / 2) * self.dt + (
+            self.volatility * np.sqrt(self.dt) * shocks
         )
-        for row in result.rows():
-            print(row)
-            stock_key = "stock:" + (row["symbol"])
-            # perturb the price and round it to 2 decimal places
-            price_multiplier = random.normalvariate(1, 0.025)
-            if row["symbol"] == "CBSE" and price_multiplier < 1:
-                price_multiplier = 1
-            new_price = float(row["price"]) * price_multiplier
-            new_price = round(new_price, 2)
-            print(stock_key)
-            res = (
-                cluster.bucket(bucket_name)
-                .default_collection()
-                .mutate_in(stock_key, [SD.upsert("price", new_price)])
+        returns[:, self.floored] = np.maximum(returns[:, self.floored], 0)
+        self.path = self.prices * np.exp(np.cumsum(returns, axis=0))
+        self.step = 0
+
+    # Indices of the stocks whose price (to the cent) moved, and the new prices
+    def tick(self):
+        if self.step == PATH_STEPS:
+            self.generate()
+        previous = np.round(self.prices, 2)
+        self.prices = self.path[self.step]
+        self.step += 1
+        current = np.round(self.prices, 2)
+        moved = np.flatnonzero(current != previous)
+        return moved, current[moved]
+
+
+# Writes price updates with a sub-document mutation per stock. Each tick's
+# updates are split into `concurrency` batches that run on their own threads,
+# and the next tick waits for them, so no more than that many are ever in
+# flight. With a price board, each tick is written there first, in one go.
+class PricePusher(object):
+    def __init__(self, collection, concurrency, board=None):
+        self.collection = collection
+        self.concurrency = concurrency
+        self.board = board
+        self.executor = ThreadPoolExecutor(concurrency)
+        self.written = 0
+        self.errors = 0
+
+    def write(self, updates):
+        errors = 0
+        for symbol, price in updates:
+            try:
+                self.collection.mutate_in(
+                    "stock:" + symbol, [SD.upsert("price", price)]
+                )
+            except Exception as e:
+                print(e)
+                errors += 1
+        return len(updates) - errors, errors
+
+    def push(self, symbols, prices):
+        updates = list(zip(symbols, prices.tolist()))
+        if not updates:
+            return
+        if self.board is not None:
+            ids = np.array([self.board.symbol_id(symbol) for symbol in symbols])
+            starting_prices = self.board.rows["starting_price"][ids]
+            changes = np.round((prices - starting_prices) * 100 / starting_prices, 2)
+            self.board.update(ids, prices, changes, starting_prices)
+        size = -(-len(updates) // self.concurrency)
+        batches = [
+            self.executor.submit(self.write, updates[start : start + size])
+            for start in range(0, len(updates), size)
+        ]
+        wait(batches)
+        for batch in batches:
+            written, errors = batch.result()
+            self.written += written
+            self.errors += errors
+
+
+def run(market, pusher, tick_rate):
+    interval = 1.0 / tick_rate
+    ticks = 0
+    written = 0
+    report_start = time.time()
+    next_tick = report_start
+    while True:
+        moved, prices = market.tick()
+        pusher.push([market.symbols[i] for i in moved], prices)
+        ticks += 1
+
+        now = time.time()
+        if now - report_start >= settings.MARKET_REPORT_INTERVAL:
+            elapsed = now - report_start
+            print(
+                (
+                    "{:.1f} ticks/s (target {}), {:.0f} price updates/s "
+                    "over {} stocks, {} failed writes"
+                ).format(
+                    ticks / elapsed,
+                    tick_rate,
+                    (pusher.written - written) / elapsed,
+                    len(market.symbols),
+                    pusher.errors,
+                )
             )
-    except Exception as e:
-        print(e)
-        pass
+            ticks = 0
+            written = pusher.written
+            report_start = now
+
+        # Keep to the tick rate, without trying to make up for slow ticks
+        next_tick = max(next_tick + interval, now)
+        time.sleep(max(next_tick - time.time(), 0))
+
+
+def main():
+    options.parse_command_line()
+
+    bucket_name = settings.BUCKET_NAME
+    user = settings.USERNAME
+    password = settings.PASSWORD
+    node = settings.CLUSTER_NODES[0]
+
+    # Connect options - authentication
+    auth = PasswordAuthenticator(
+        user,
+        password,
+    )
+    # Get a reference to our cluster
+    # NOTE: For TLS/SSL connection use 'couchbases://<your-ip-address>' instead
+    cluster = Cluster(f"couchbase://{node}", ClusterOptions(auth))
+
+    # Wait until the cluster is ready for use.
+    cluster.wait_until_ready(timedelta(seconds=15))
+
+    # Prices are read once; from then on the market is the source of truth
+    rows = queries.MARKET_PRICES.rows(cluster)
+    if options.symbols:
+        rows = rows[: options.symbols]
+    print(("Moving {} stocks at {} ticks/s").format(len(rows), options.tick_rate))
+
+    market = Market(
+        [row["symbol"] for row in rows],
+        [float(row["price"]) for row in rows],
+        options.drift,
+        options.volatility,
+        1.0 / options.tick_rate,
+        options.seed,
+    )
+    board = None
+    if options.board:
+        board = price_board.PriceBoard(writable=True)
+        for row in rows:
+            price = float(row["price"])
+            starting_price = float(row["starting_price"])
+            board.set(
+                row["symbol"],
+                price,
+                price_feed.price_change(price, starting_price),
+                starting_price,
+            )
+    pusher = PricePusher(
+        cluster.bucket(bucket_name).default_collection(), options.concurrency, board
+    )
+    run(market, pusher, options.tick_rate)
+
 
-    time.sleep(8)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env - python
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+
+import tornado.ioloop
+
+import metrics
+import settings
+
+LOOP_LAG = metrics.Histogram(
+    "cbex_loop_lag_seconds", "How late the event loop ran a timer it was due to run"
+)
+
+
+# Watches for anything holding up the IOLoop. A timer on the loop records how
+# late it fires; a watchdog thread notices when that timer has stopped firing
+# for longer than `threshold` and prints what the loop thread is running, once
+# per stall, while the culprit is still on the stack.
+class LoopMonitor(object):
+    def __init__(
+        self, interval=settings.LOOP_LAG_INTERVAL, threshold=settings.LOOP_LAG_THRESHOLD
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.thread_id = None
+        self.beat = None
+        self.timer = None
+        self.lag = LOOP_LAG.labels()
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.beat = time.time()
+        self.timer = tornado.ioloop.PeriodicCallback(self.tick, self.interval * 1000)
+        self.timer.start()
+        threading.Thread(target=self.watch, name="loop-monitor", daemon=True).start()
+
+    def tick(self):
+        now = time.time()
+        self.lag.observe(max(now - self.beat - self.interval, 0))
+        self.beat = now
+
+    def watch(self):
+        reported = None
+        while True:
+            time.sleep(self.interval)
+            beat = self.beat
+            stalled = time.time() - beat - self.interval
+            if stalled < self.threshold or reported == beat:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            print(
+                ("Event loop blocked for {:.0f}ms, at:\n{}").format(
+                    stalled * 1000, "".join(traceback.format_stack(frame))
+                )
+            )
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return "{}:{}".format(os.path.basename(code.co_filename), code.co_name)
+
+
+# Sampling profiler: a thread looks at what the loop thread (or every thread)
+# is running every `interval` seconds and counts each distinct stack. The
+# result is in the collapsed format flamegraph.pl and speedscope read, one
+# "outer;...;inner count" line per stack.
+class Profiler(object):
+    def __init__(self, thread_id=None):
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.running = False
+        self.stacks = collections.Counter()
+        self.thread = None
+
+    def start(self, interval=settings.PROFILER_INTERVAL, all_threads=False):
+        self.running = True
+        self.stacks = collections.Counter()
+        self.thread = threading.Thread(
+            target=self.sample,
+            args=(interval, all_threads),
+            name="profiler",
+            daemon=True,
+        )
+        self.thread.start()
+
+    def sample(self, interval, all_threads):
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while self.running:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                if not all_threads and thread_id != self.thread_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                if all_threads:
+                    if thread_id not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        return "".join(
+            "{} {}\n".format(stack, count) for stack, count in self.stacks.most_common()
+        )
@@ -0,0 +1,168 @@
+#!/usr/bin/env - python
+import bisect
+import time
+
+# Upper bounds, in seconds, for latency histograms
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+# Upper bounds, in bytes, for payload size histograms
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152)
+
+registry = []
+
+
+def escape(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def label_text(names, values, extra=""):
+    pairs = [
+        '{}="{}"'.format(name, escape(value)) for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# A metric with a fixed set of label names; labels(...) returns the child for
+# one set of values, which callers on hot paths should look up once and keep.
+# Recording is a dict lookup and an add, and nothing is formatted until
+# someone scrapes /metrics.
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.children = {}
+        registry.append(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.child()
+        return child
+
+    def samples(self):
+        for values, child in sorted(self.children.items()):
+            yield self.name, label_text(self.label_names, values), child.value
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        for name, labels, value in self.samples():
+            lines.append("{}{} {}".format(name, labels, value))
+        return "\n".join(lines)
+
+
+class CounterChild(object):
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(Metric):
+    kind = "counter"
+    child = CounterChild
+
+
+class GaugeChild(object):
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+    child = GaugeChild
+
+
+class HistogramChild(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    # Times the block it wraps
+    def time(self):
+        return Timer(self)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super(Histogram, self).__init__(name, help, labels)
+
+    def child(self):
+        return HistogramChild(self.buckets)
+
+    def samples(self):
+        for values, child in sorted(self.children.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), child.counts):
+                total += count
+                yield (
+                    self.name + "_bucket",
+                    label_text(self.label_names, values, 'le="{}"'.format(bound)),
+                    total,
+                )
+            labels = label_text(self.label_names, values)
+            yield self.name + "_sum", labels, child.sum
+            yield self.name + "_count", labels, total
+
+
+class Timer(object):
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.time() - self.start)
+
+
+# Values that already live somewhere else (queue lengths, subscriber counts,
+# counters kept by other objects) are only read when scraped. `collect`
+# returns a dict of label value tuples to values.
+class Collected(Metric):
+    def __init__(self, name, help, labels, collect, kind="gauge"):
+        self.collect = collect
+        self.kind = kind
+        super(Collected, self).__init__(name, help, labels)
+
+    def samples(self):
+        for values, value in sorted(self.collect().items()):
+            yield self.name, label_text(self.label_names, values), value
+
+
+def render():
+    return "\n".join(metric.render() for metric in registry) + "\n"
@@ -0,0 +1,108 @@
+#!/usr/bin/env - python
+import uuid
+
+import tornado.gen
+import tornado.ioloop
+import tornado.queues
+from tornado.concurrent import Future
+
+# needed for durable writes
+from couchbase.durability import DurabilityLevel, ServerDurability
+
+import db
+import settings
+
+# Tags the orders this process wrote, so polling the bucket for orders can
+# skip the ones it has already published
+ORIGIN = uuid.uuid4().hex
+
+
+# Write-behind queue for submitted orders. Orders wait in a bounded queue and
+# `writers` loops each upsert whatever has queued up as one batch, so while
+# one batch is in flight the next one grows: a group commit. What submit()
+# waits for depends on `durability`:
+#   accepted  - the order is queued (failed writes are retried in the background)
+#   persisted - the batch holding the order has been written
+#   majority  - ... and replicated to a majority of the nodes
+class OrderWriter(object):
+    def __init__(
+        self,
+        data_access,
+        durability=settings.ORDER_DURABILITY,
+        batch_size=settings.ORDER_BATCH_SIZE,
+        queue_size=settings.ORDER_QUEUE_SIZE,
+        writers=settings.ORDER_WRITERS,
+    ):
+        self.data_access = data_access
+        self.durability = durability
+        self.batch_size = batch_size
+        self.writers = writers
+        self.queue = tornado.queues.Queue(maxsize=queue_size)
+        self.options = {}
+        if durability == "majority":
+            self.options["durability"] = ServerDurability(DurabilityLevel.MAJORITY)
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+
+    def start(self):
+        for _ in range(self.writers):
+            tornado.ioloop.IOLoop.current().spawn_callback(self.run)
+
+    def submit(self, key, doc):
+        done = Future()
+        waiter = None if self.durability == "accepted" else done
+        try:
+            self.queue.put_nowait((key, doc, waiter))
+        except tornado.queues.QueueFull:
+            raise db.Overloaded()
+        if waiter is None:
+            done.set_result(None)
+        return done
+
+    @tornado.gen.coroutine
+    def run(self):
+        while True:
+            batch = [(yield self.queue.get())]
+            while len(batch) < self.batch_size and self.queue.qsize():
+                batch.append(self.queue.get_nowait())
+            yield self.flush(batch)
+
+    @tornado.gen.coroutine
+    def flush(self, batch):
+        docs = {key: doc for key, doc, _ in batch}
+        try:
+            result = yield self.data_access.upsert_multi(docs, **self.options)
+            errors = result.exceptions or {}
+        except Exception as e:
+            errors = {key: e for key in docs}
+        self.batches += 1
+        self.written += len(docs) - len(errors)
+        self.failed += len(errors)
+
+        retry = []
+        for key, doc, waiter in batch:
+            error = errors.get(key)
+            if waiter is not None:
+                if error is None:
+                    waiter.set_result(None)
+                else:
+                    waiter.set_exception(error)
+            elif error is not None:
+                retry.append((key, doc, waiter))
+        if retry:
+            print(("Retrying {} order writes: {}").format(len(retry), errors))
+            yield tornado.gen.sleep(1)
+            for item in retry:
+                try:
+                    self.queue.put_nowait(item)
+                except tornado.queues.QueueFull:
+                    print(("Dropped order {}").format(item[0]))
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+        }
@@ -0,0 +1,167 @@
+#!/usr/bin/env - python
+import numpy as np
+
+import broadcast
+import settings
+
+# Every order holds exactly five stocks (see SubmitHandler)
+ORDER_WIDTH = 5
+NO_GEO = -1
+
+ORDER_DTYPE = np.dtype(
+    [
+        ("name", np.int32),
+        ("geo", np.int32),
+        ("ts", np.int64),
+        ("stocks", np.int8),
+        ("symbol", np.int32, ORDER_WIDTH),
+        ("purchase_price", np.float64, ORDER_WIDTH),
+        ("quantity", np.float64, ORDER_WIDTH),
+        ("value", np.float64),
+    ]
+)
+
+
+# Append-only log of every order the app has seen, one fixed-size record per
+# order with investor names, geos and symbols interned to small ids. The
+# newest `memory_cap` records live in memory; once that fills up the older
+# half is spilled to a memory-mapped file. Records are addressed by their
+# position in the log, so readers just keep an integer cursor.
+class OrderLog(object):
+    def __init__(
+        self, path=settings.ORDER_LOG_FILE, memory_cap=settings.ORDER_LOG_MEMORY_CAP
+    ):
+        self.path = path
+        self.hot = np.zeros(memory_cap, dtype=ORDER_DTYPE)
+        self.cold = None
+        self.spilled = 0
+        self.count = 0
+        self.names = []
+        self.name_ids = {}
+        self.geos = []
+        self.geo_ids = {}
+        self.symbols = []
+        self.symbol_ids = {}
+
+    def __len__(self):
+        return self.count
+
+    def intern(self, value, values, ids):
+        if value not in ids:
+            ids[value] = len(values)
+            values.append(value)
+        return ids[value]
+
+    def symbol_id(self, symbol):
+        return self.intern(symbol, self.symbols, self.symbol_ids)
+
+    def append(self, order):
+        if self.count - self.spilled == len(self.hot):
+            self.spill()
+        record = self.hot[self.count - self.spilled]
+        record["name"] = self.intern(order["name"], self.names, self.name_ids)
+        if "geo" in order:
+            record["geo"] = self.intern(order["geo"], self.geos, self.geo_ids)
+        else:
+            record["geo"] = NO_GEO
+        record["ts"] = order["ts"]
+        record["stocks"] = len(order["order"])
+        record["symbol"] = 0
+        record["purchase_price"] = 0
+        record["quantity"] = 0
+        for column, stock in enumerate(order["order"]):
+            record["symbol"][column] = self.symbol_id(stock["symbol"])
+            record["purchase_price"][column] = stock["purchase_price"]
+            record["quantity"][column] = stock["quantity"]
+        record["value"] = order.get("current_value", 0)
+        self.count += 1
+        return self.count - 1
+
+    # Moves the oldest half of the in-memory records to the end of the file
+    def spill(self):
+        moving = max(len(self.hot) // 2, 1)
+        needed = self.spilled + moving
+        if self.cold is None or len(self.cold) < needed:
+            capacity = max(needed, 2 * (0 if self.cold is None else len(self.cold)))
+            self.remap(capacity)
+        self.cold[self.spilled : needed] = self.hot[:moving]
+        remaining = self.count - needed
+        self.hot[:remaining] = self.hot[moving : moving + remaining]
+        self.spilled = needed
+
+    def remap(self, capacity):
+        if self.cold is None:
+            mode = "w+"
+        else:
+            self.cold.flush()
+            self.cold = None
+            with open(self.path, "r+b") as spill_file:
+                spill_file.truncate(capacity * ORDER_DTYPE.itemsize)
+            mode = "r+"
+        self.cold = np.memmap(
+            self.path, dtype=ORDER_DTYPE, mode=mode, shape=(capacity,)
+        )
+
+    def record(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        if index < self.spilled:
+            return self.cold[index]
+        return self.hot[index - self.spilled]
+
+    # Views over every record, oldest first, for vectorised passes
+    def segments(self):
+        if self.spilled:
+            yield self.cold[: self.spilled]
+        yield self.hot[: self.count - self.spilled]
+
+    # Rebuilds the order document a record was made from
+    def order(self, index):
+        record = self.record(index)
+        order = {
+            "name": self.names[record["name"]],
+            "ts": int(record["ts"]),
+            "type": "order",
+            "order": [
+                {
+                    "symbol": self.symbols[record["symbol"][column]],
+                    "purchase_price": float(record["purchase_price"][column]),
+                    "quantity": float(record["quantity"][column]),
+                }
+                for column in range(record["stocks"])
+            ],
+            "current_value": float(record["value"]),
+        }
+        if record["geo"] != NO_GEO:
+            order["geo"] = self.geos[record["geo"]]
+        return order
+
+    # Orders from `cursor` onwards, plus the cursor to pass next time
+    def read(self, cursor, limit=None):
+        end = self.count if limit is None else min(self.count, cursor + limit)
+        return [self.order(index) for index in range(cursor, end)], end
+
+
+# The live orders ticker: each call shows the next of the 50 most recent
+# orders nobody has seen yet, or None when there is nothing new (`idle` until
+# there is). The demo phone's own orders are held on screen for an extra call.
+class OrderFeed(object):
+    def __init__(self, log, recent=50):
+        self.log = log
+        self.recent = recent
+        self.cursor = 0
+        self.hold = False
+        self.idle = True
+
+    def next(self):
+        if self.hold:
+            self.hold = False
+            return None
+        self.cursor = max(self.cursor, len(self.log) - self.recent)
+        recent_orders, self.cursor = self.log.read(self.cursor, 1)
+        self.idle = not recent_orders
+        if self.idle:
+            return None
+        order = recent_orders[0]
+        self.hold = order["name"] == "Couchbase Demo Phone"
+        return broadcast.encode({"name": order["name"], "order": order["order"]})
@@ -0,0 +1,175 @@
+#!/usr/bin/env - python
+import os
+
+import numpy as np
+
+import settings
+
+MAGIC = b"CBEXPB01"
+# The header is padded out so every row, and so every row's sequence number,
+# is 8 byte aligned
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("capacity", np.uint32),
+        ("count", np.uint32),
+        ("version", np.uint64),
+    ]
+)
+ROW_DTYPE = np.dtype(
+    [
+        ("seq", np.uint64),
+        ("symbol", "S16"),
+        ("price", np.float64),
+        ("change", np.float64),
+        ("starting_price", np.float64),
+    ]
+)
+
+
+# Current prices in a memory-mapped file, one fixed-size row per symbol, so
+# any local process can read them without asking the bucket. Symbols get the
+# next free row the first time they are written and keep it for the life of
+# the file. There is a single writer; rows are guarded by seqlocks, so
+# readers never wait on it: a row's sequence number is odd while the writer
+# is part way through it, and a reader that sees it odd, or changed by the
+# time it has copied the row, reads the row again. `version` moves on every
+# write so readers can tell cheaply whether anything has.
+class PriceBoard(object):
+    def __init__(
+        self,
+        path=settings.PRICE_BOARD_FILE,
+        capacity=settings.PRICE_BOARD_CAPACITY,
+        writable=False,
+    ):
+        self.path = path
+        self.writable = writable
+        if writable:
+            self.create(capacity)
+        self.header = np.memmap(
+            path, dtype=HEADER_DTYPE, mode="r+" if writable else "r", shape=(1,)
+        )
+        if self.header["magic"][0] != MAGIC:
+            raise ValueError("{} is not a price board".format(path))
+        self.capacity = int(self.header["capacity"][0])
+        self.rows = np.memmap(
+            path,
+            dtype=ROW_DTYPE,
+            mode="r+" if writable else "r",
+            offset=HEADER_SIZE,
+            shape=(self.capacity,),
+        )
+        self.seq = self.rows["seq"]
+        self.symbols = []
+        self.ids = {}
+        self.sync()
+        if writable:
+            # Finish any write the last writer was part way through
+            self.seq[self.seq & 1 == 1] += 1
+
+    # Keeps a board of the same capacity (and so every symbol's row) and
+    # starts a new one otherwise
+    def create(self, capacity):
+        size = HEADER_SIZE + capacity * ROW_DTYPE.itemsize
+        if os.path.exists(self.path) and os.path.getsize(self.path) == size:
+            header = np.fromfile(self.path, dtype=HEADER_DTYPE, count=1)
+            if header["magic"][0] == MAGIC and header["capacity"][0] == capacity:
+                return
+        with open(self.path, "wb") as board_file:
+            board_file.truncate(size)
+        header = np.memmap(self.path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+        header["magic"] = MAGIC
+        header["capacity"] = capacity
+        header.flush()
+
+    @property
+    def count(self):
+        return int(self.header["count"][0])
+
+    @property
+    def version(self):
+        return int(self.header["version"][0])
+
+    # Picks up symbols the writer has added since
+    def sync(self):
+        for symbol in self.rows["symbol"][len(self.symbols) : self.count]:
+            self.ids[symbol.decode()] = len(self.symbols)
+            self.symbols.append(symbol.decode())
+
+    def symbol_id(self, symbol):
+        if symbol not in self.ids:
+            self.sync()
+        if symbol not in self.ids and self.writable:
+            return self.add(symbol)
+        return self.ids.get(symbol)
+
+    def add(self, symbol):
+        row = self.count
+        if row == self.capacity:
+            raise ValueError("The price board is full")
+        self.rows["symbol"][row] = symbol.encode()
+        # Readers only look as far as `count`, so the row is complete before
+        # they can see it
+        self.header["count"] = row + 1
+        self.ids[symbol] = row
+        self.symbols.append(symbol)
+        return row
+
+    def set(self, symbol, price, change, starting_price):
+        self.update(np.array([self.symbol_id(symbol)]), price, change, starting_price)
+
+    # Writes the rows `ids` at once, with one increment of their sequence
+    # numbers either side
+    def update(self, ids, prices, changes, starting_prices):
+        self.seq[ids] += 1
+        self.rows["price"][ids] = prices
+        self.rows["change"][ids] = changes
+        self.rows["starting_price"][ids] = starting_prices
+        self.seq[ids] += 1
+        self.header["version"] += 1
+
+    def read(self, row):
+        while True:
+            seq = self.seq[row]
+            if seq & 1:
+                continue
+            copy = self.rows[row].copy()
+            if self.seq[row] == seq:
+                return copy
+
+    def get(self, symbol):
+        row = self.symbol_id(symbol)
+        if row is None:
+            return None
+        copy = self.read(row)
+        return {
+            "price": float(copy["price"]),
+            "change": float(copy["change"]),
+            "starting_price": float(copy["starting_price"]),
+        }
+
+    # A consistent copy of every row: rows copied while the writer was part
+    # way through them are read again one by one
+    def snapshot(self):
+        count = self.count
+        copy = self.rows[:count].copy()
+        torn = np.flatnonzero(
+            (copy["seq"] & 1).astype(bool) | (copy["seq"] != self.seq[:count])
+        )
+        for row in torn:
+            copy[row] = self.read(row)
+        return copy
+
+    def sequences(self):
+        return self.seq[: self.count].copy()
+
+    # Zero-copy view of one column (price, change or starting_price) for
+    # vectorised work. Values are never torn, but a row's columns are only
+    # guaranteed to agree with each other through read() and snapshot().
+    def column(self, name):
+        return self.rows[name][: self.count]
+
+    def flush(self):
+        self.rows.flush()
+        self.header.flush()
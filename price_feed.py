@@ -0,0 +1,63 @@
+#!/usr/bin/env - python
+import numpy as np
+
+import queries
+import settings
+
+# CAS values are hybrid logical clocks in nanoseconds, so a skew window in
+# seconds converts directly. Documents in the window are read again next tick,
+# which is harmless because applying a price is idempotent.
+CAS_PER_SECOND = 1000000000
+
+
+# Percentage move from the starting price, as shown on the exchange page
+def price_change(price, starting_price):
+    return round(((price - starting_price) * 100) / starting_price, 2)
+
+
+# Price changes straight from the bucket. A cursor of None asks for every
+# stock document, any other cursor only for those mutated after it.
+class N1QLPriceFeed(object):
+    def __init__(self, cluster, skew=settings.PRICE_CURSOR_SKEW):
+        self.cluster = cluster
+        self.skew = int(skew * CAS_PER_SECOND)
+
+    def changes(self, cursor=None):
+        if cursor is None:
+            rows = queries.PRICES.rows(self.cluster)
+        else:
+            rows = queries.PRICE_CHANGES.rows(self.cluster, cursor - self.skew)
+        for row in rows:
+            if cursor is None or row["cas"] > cursor:
+                cursor = row["cas"]
+        return rows, cursor
+
+
+# Price changes from a price board that a local process (live_market.py
+# --board) writes: the rows whose sequence number has moved since the cursor,
+# which is the sequence numbers as they were last time. A cursor of None still
+# reads every stock document from `feed`, since the board only keeps prices.
+class BoardPriceFeed(object):
+    def __init__(self, board, feed):
+        self.board = board
+        self.feed = feed
+
+    def changes(self, cursor=None):
+        sequences = self.board.sequences()
+        if cursor is None:
+            rows, _ = self.feed.changes(None)
+            return rows, sequences
+        moved = np.flatnonzero(sequences[: len(cursor)] != cursor)
+        added = np.arange(len(cursor), len(sequences))
+        self.board.sync()
+        rows = []
+        for row in np.concatenate([moved, added]):
+            copy = self.board.read(row)
+            rows.append(
+                {
+                    "symbol": self.board.symbols[row],
+                    "price": float(copy["price"]),
+                    "starting_price": float(copy["starting_price"]),
+                }
+            )
+        return rows, sequences
@@ -0,0 +1,143 @@
+#!/usr/bin/env - python
+import os
+
+import numpy as np
+
+import settings
+
+# Bar widths /history downsamples to, in seconds
+INTERVALS = {"1s": 1, "1m": 60, "5m": 300}
+
+
+# Recent prices of every symbol, for charts. Each symbol has a ring of the
+# last `capacity` (ts, price) samples in a slot of a memory-mapped segment
+# file, `segment_size` slots to a file, so the history survives a restart and
+# other local processes (the web workers) read what the ingest loop writes
+# without copying it. A slot's `head` counts every sample ever written to it;
+# the newest is at head - 1, modulo the capacity. Samples are written before
+# the head moves past them, and readers skip the oldest sample of a full ring
+# in case it is being overwritten.
+class PriceHistory(object):
+    def __init__(
+        self,
+        path=settings.PRICE_HISTORY_DIR,
+        capacity=settings.PRICE_HISTORY_CAPACITY,
+        segment_size=settings.PRICE_HISTORY_SEGMENT,
+    ):
+        self.path = path
+        self.capacity = capacity
+        self.segment_size = segment_size
+        self.dtype = np.dtype(
+            [
+                ("symbol", "S16"),
+                ("head", "<u8"),
+                ("ts", "<f8", (capacity,)),
+                ("price", "<f8", (capacity,)),
+            ]
+        )
+        self.segments = []
+        self.ids = {}
+        self.sync()
+
+    def segment_path(self, number):
+        return os.path.join(self.path, "segment-{:04d}.bin".format(number))
+
+    # Picks up segments and symbols added since, by this process or another
+    def sync(self):
+        while os.path.exists(self.segment_path(len(self.segments))):
+            path = self.segment_path(len(self.segments))
+            if os.path.getsize(path) != self.segment_size * self.dtype.itemsize:
+                raise ValueError(
+                    "{} was written with another PRICE_HISTORY_CAPACITY or "
+                    "PRICE_HISTORY_SEGMENT".format(path)
+                )
+            self.segments.append(
+                np.memmap(path, dtype=self.dtype, mode="r+", shape=(self.segment_size,))
+            )
+        # Slots are handed out in order, so only the ones after the last
+        # known symbol need looking at
+        while True:
+            number, slot = divmod(len(self.ids), self.segment_size)
+            if number == len(self.segments):
+                break
+            symbol = self.segments[number]["symbol"][slot]
+            if not symbol:
+                break
+            self.ids[symbol.decode()] = len(self.ids)
+
+    def slot_id(self, symbol, create=False):
+        if symbol not in self.ids:
+            self.sync()
+        if symbol not in self.ids and create:
+            self.add(symbol)
+        return self.ids.get(symbol)
+
+    def add(self, symbol):
+        number, slot = divmod(len(self.ids), self.segment_size)
+        if number == len(self.segments):
+            os.makedirs(self.path, exist_ok=True)
+            self.segments.append(
+                np.memmap(
+                    self.segment_path(number),
+                    dtype=self.dtype,
+                    mode="w+",
+                    shape=(self.segment_size,),
+                )
+            )
+        self.segments[number]["symbol"][slot] = symbol.encode()
+        self.ids[symbol] = len(self.ids)
+
+    # Adds one sample per symbol, all taken at `ts`, a segment at a time
+    def record(self, symbols, prices, ts):
+        ids = np.array([self.slot_id(symbol, create=True) for symbol in symbols])
+        prices = np.asarray(prices, dtype=np.float64)
+        numbers, slots = np.divmod(ids, self.segment_size)
+        for number in np.unique(numbers):
+            here = numbers == number
+            segment = self.segments[number]
+            heads = segment["head"][slots[here]]
+            positions = heads % self.capacity
+            segment["price"][slots[here], positions] = prices[here]
+            segment["ts"][slots[here], positions] = ts
+            segment["head"][slots[here]] = heads + 1
+
+    # A symbol's samples, oldest first, or None if it has none
+    def samples(self, symbol):
+        slot_id = self.slot_id(symbol)
+        if slot_id is None:
+            return None
+        number, slot = divmod(slot_id, self.segment_size)
+        segment = self.segments[number]
+        head = int(segment["head"][slot])
+        ts = segment["ts"][slot]
+        prices = segment["price"][slot]
+        if head <= self.capacity:
+            return ts[:head], prices[:head]
+        split = head % self.capacity
+        return (
+            np.concatenate([ts[split + 1 :], ts[:split]]),
+            np.concatenate([prices[split + 1 :], prices[:split]]),
+        )
+
+    # Open, high, low and close of the samples between `start` and `end`
+    # (inclusive) in bars `width` seconds wide, one per bar that has samples
+    def ohlc(self, symbol, width, start=0, end=float("inf")):
+        samples = self.samples(symbol)
+        if samples is None:
+            return None
+        ts, prices = samples
+        first, last = np.searchsorted(ts, start), np.searchsorted(ts, end, "right")
+        ts = ts[first:last]
+        prices = prices[first:last]
+        if not len(ts):
+            return {"time": [], "open": [], "high": [], "low": [], "close": []}
+        bars = np.floor(ts / width)
+        opens = np.flatnonzero(np.r_[True, bars[1:] != bars[:-1]])
+        closes = np.r_[opens[1:], len(ts)] - 1
+        return {
+            "time": (bars[opens] * width).tolist(),
+            "open": prices[opens].tolist(),
+            "high": np.maximum.reduceat(prices, opens).tolist(),
+            "low": np.minimum.reduceat(prices, opens).tolist(),
+            "close": prices[closes].tolist(),
+        }
@@ -0,0 +1,98 @@
+#!/usr/bin/env - python
+# Every N1QL statement the app sends, by name. Only the bucket name is
+# formatted into a statement, once, when it is registered; anything that
+# varies per call is a parameter. The text therefore never changes, so the
+# statements are run with adhoc=False and the query service plans each one
+# once and reuses the plan, instead of parsing and planning it on every call.
+
+from datetime import timedelta
+
+from couchbase.n1ql import QueryScanConsistency
+
+# needed for options -- timeout, SQL++ (N1QL) query parameters, etc.
+from couchbase.options import QueryOptions
+
+import settings
+
+statements = {}
+
+
+# A named statement with its own timeout (in seconds) and scan consistency
+# ("not_bounded" or "request_plus")
+class Statement(object):
+    def __init__(
+        self,
+        name,
+        text,
+        timeout=settings.TIMEOUT,
+        consistency=settings.QUERY_SCAN_CONSISTENCY,
+    ):
+        self.name = name
+        self.text = text
+        self.timeout = timedelta(seconds=timeout)
+        self.consistency = QueryScanConsistency(consistency)
+
+    def options(self, *positional, **named):
+        options = QueryOptions(
+            adhoc=False, timeout=self.timeout, scan_consistency=self.consistency
+        )
+        if positional:
+            options["positional_parameters"] = list(positional)
+        if named:
+            options["named_parameters"] = named
+        return options
+
+    # Runs the statement and reads every row. This blocks, so the app runs it
+    # through DataAccess.execute.
+    def rows(self, cluster, *positional, **named):
+        return list(cluster.query(self.text, self.options(*positional, **named)).rows())
+
+
+def register(name, text, **kwargs):
+    statements[name] = Statement(
+        name, text.format(bucket=settings.BUCKET_NAME), **kwargs
+    )
+    return statements[name]
+
+
+PRICE_SELECT = "SELECT symbol,company,sector,price,starting_price,META().cas AS cas \
+FROM {bucket} WHERE symbol IS NOT MISSING AND price IS NOT MISSING"
+# Every stock document
+PRICES = register("prices", PRICE_SELECT)
+# Stock documents mutated after the CAS $1
+PRICE_CHANGES = register("price_changes", PRICE_SELECT + " AND META().cas > $1")
+
+# The next $4 orders after (ts $2, key $3) not written by origin $1
+ORDERS = register(
+    "orders",
+    "SELECT META(doc).id AS id, doc.* FROM {bucket} AS doc \
+WHERE doc.type='order' AND (doc.origin IS MISSING OR doc.origin != $1) \
+AND (doc.ts > $2 OR (doc.ts = $2 AND META(doc).id > $3)) \
+ORDER BY doc.ts, META(doc).id LIMIT $4",
+)
+
+# Every investment in the USA, EU and unknown geos; it reads every order
+GEO = register(
+    "geo",
+    "SELECT portfolio.symbol, doc.name, portfolio.purchase_price, \
+portfolio.quantity, IFMISSING(doc.`geo`, 'Unknown') AS geo FROM {bucket} AS doc \
+UNNEST doc.`order` AS portfolio WHERE doc.`type`=='order' \
+AND (doc.`geo` IS MISSING OR doc.`geo` IN ['USA', 'EU']) \
+ORDER BY portfolio.symbol",
+    timeout=settings.TIMEOUT * 4,
+)
+
+# The $1 best and worst performing stocks
+PERFORMANCE = "SELECT price_diff,symbol,company,starting_price,price FROM {bucket} \
+LET price_diff = 100 * ((price - starting_price))/starting_price \
+WHERE symbol IS NOT MISSING ORDER BY price_diff {order} LIMIT $1"
+BEST_STOCKS = register("best_stocks", PERFORMANCE.replace("{order}", "DESC"))
+WORST_STOCKS = register("worst_stocks", PERFORMANCE.replace("{order}", "ASC"))
+
+# Every stock's price, for live_market.py to start from
+MARKET_PRICES = register(
+    "market_prices",
+    "SELECT symbol,price,starting_price FROM {bucket} \
+WHERE symbol IS NOT MISSING AND price IS NOT MISSING ORDER BY symbol",
+    timeout=15,
+)
@@ -0,0 +1,152 @@
+#!/usr/bin/env - python
+import bisect
+import collections
+import re
+import time
+
+import settings
+
+WORD_RE = re.compile(r"\w+")
+
+# Scores for how a query term matched a word in a stock's fields
+EXACT = 3
+PREFIX = 2
+FUZZY = 1
+
+
+def words(text):
+    return WORD_RE.findall(text.lower())
+
+
+# Levenshtein distance, giving up as soon as it must exceed `limit`
+def distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+# Burkhard-Keller tree over the vocabulary: children are keyed by their edit
+# distance from the parent, so a fuzzy lookup only descends into the
+# branches the triangle inequality allows
+class BKTree(object):
+    def __init__(self):
+        self.root = None
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            parent, children = node
+            d = distance(word, parent, len(word) + len(parent))
+            if d == 0:
+                return
+            if d not in children:
+                children[d] = (word, {})
+                return
+            node = children[d]
+
+    def find(self, word, limit):
+        found = []
+        pending = [self.root] if self.root is not None else []
+        while pending:
+            candidate, children = pending.pop()
+            # The children to visit depend on the exact distance, so it
+            # cannot be cut off at the limit
+            d = distance(word, candidate, len(word) + len(candidate))
+            if d <= limit:
+                found.append(candidate)
+            for child_distance, child in children.items():
+                if d - limit <= child_distance <= d + limit:
+                    pending.append(child)
+        return found
+
+
+# In-process full text search over the symbol, company and sector of every
+# stock in the catalog. Each query term matches words exactly, as a prefix
+# (for typeahead) or within one edit; stocks are ranked by how well and how
+# many of the terms matched, like a disjunction of `term~1` FTS clauses.
+class SearchIndex(object):
+    def __init__(self):
+        self.postings = {}
+        self.vocabulary = []
+        self.tree = BKTree()
+
+    def build(self, stocks):
+        postings = {}
+        for key, stock in stocks.items():
+            for field in ("symbol", "company", "sector"):
+                for word in words(str(stock.get(field, ""))):
+                    postings.setdefault(word, set()).add(key)
+        self.postings = postings
+        self.vocabulary = sorted(postings)
+        self.tree = BKTree()
+        for word in self.vocabulary:
+            self.tree.add(word)
+
+    def matches(self, term):
+        scores = {term: EXACT} if term in self.postings else {}
+        start = bisect.bisect_left(self.vocabulary, term)
+        for word in self.vocabulary[start:]:
+            if not word.startswith(term):
+                break
+            scores.setdefault(word, PREFIX)
+        for word in self.tree.find(term, settings.SEARCH_FUZZINESS):
+            scores.setdefault(word, FUZZY)
+        return scores
+
+    def search(self, query, limit=settings.SEARCH_RESULT_LIMIT):
+        totals = collections.Counter()
+        for term in set(words(query)):
+            best = {}
+            for word, score in self.matches(term).items():
+                for key in self.postings[word]:
+                    if best.get(key, 0) < score:
+                        best[key] = score
+            totals.update(best)
+        ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+        return [key for key, _ in ranked[:limit]]
+
+
+# Least recently used cache of search results that also forgets entries
+# older than `ttl` seconds
+class ResultCache(object):
+    def __init__(self, size=settings.SEARCH_CACHE_SIZE, ttl=settings.SEARCH_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+
+    def get(self, query):
+        entry = self.entries.get(query)
+        if entry is None:
+            return None
+        stored, results = entry
+        if time.time() - stored > self.ttl:
+            del self.entries[query]
+            return None
+        self.entries.move_to_end(query)
+        return results
+
+    def put(self, query, results):
+        self.entries[query] = (time.time(), results)
+        self.entries.move_to_end(query)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
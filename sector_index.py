@@ -0,0 +1,64 @@
+#!/usr/bin/env - python
+import bisect
+import heapq
+
+
+# Inverted index over the catalog: each sector maps to a sorted list of stock
+# keys, and every stock's price change is kept in one sorted list so range
+# filters are a pair of bisects. Lookups intersect the two without touching
+# the cluster.
+class SectorIndex(object):
+    def __init__(self):
+        self.sectors = {}
+        self.sector_of = {}
+        self.change_of = {}
+        self.by_change = []
+
+    def build(self, stocks, changes):
+        self.sectors = {}
+        self.sector_of = {}
+        self.change_of = {}
+        for key in sorted(stocks):
+            sector = stocks[key].get("sector")
+            self.sector_of[key] = sector
+            self.sectors.setdefault(sector, []).append(key)
+            self.change_of[key] = changes[key]
+        self.by_change = sorted((change, key) for key, change in self.change_of.items())
+
+    def move(self, key, sector):
+        old_sector = self.sector_of[key]
+        if old_sector == sector:
+            return
+        keys = self.sectors[old_sector]
+        del keys[bisect.bisect_left(keys, key)]
+        bisect.insort(self.sectors.setdefault(sector, []), key)
+        self.sector_of[key] = sector
+
+    def set_change(self, key, change):
+        old_change = self.change_of[key]
+        if old_change == change:
+            return
+        del self.by_change[bisect.bisect_left(self.by_change, (old_change, key))]
+        bisect.insort(self.by_change, (change, key))
+        self.change_of[key] = change
+
+    # Sorted keys of the stocks in any of `sectors` (all stocks if none are
+    # given) whose change is within [min_change, max_change]
+    def lookup(self, sectors=(), min_change=None, max_change=None):
+        if sectors:
+            keys = list(
+                heapq.merge(*[self.sectors.get(sector, []) for sector in set(sectors)])
+            )
+        else:
+            keys = sorted(self.sector_of)
+        if min_change is None and max_change is None:
+            return keys
+
+        low = 0
+        high = len(self.by_change)
+        if min_change is not None:
+            low = bisect.bisect_left(self.by_change, (min_change,))
+        if max_change is not None:
+            high = bisect.bisect_right(self.by_change, (max_change, chr(0x10FFFF)))
+        in_range = set(key for _, key in self.by_change[low:high])
+        return [key for key in keys if key in in_range]
@@ -7,7 +7,7 @@ FTS_INDEX_NAME = "cbex"
 # Stock file model
 STOCKS_FILE = "stocks.json"
 # The list of nodes
-CLUSTER_NODES = ["10.2.1.181","10.2.2.153","10.2.3.25"]
+CLUSTER_NODES = ["10.2.1.181", "10.2.2.153", "10.2.3.25"]
 # Exposed web port e.g. 8888 or 80
 WEB_PORT = 8080
 # Whether the current cluster is on AWS
@@ -24,7 +24,7 @@ ADMIN_PASS = "password"
 DDOC_NAME = "orders"
 # Name of the view
 VIEW_NAME = "by_timestamp"
-# Doc containing all stocks. 
+# Doc containing all stocks.
 # Single field called "symbols" which is a list containing all product keys.
 PRODUCT_LIST = "stock_list"
 # How many stocks should we use?
@@ -35,5 +35,121 @@ FLAVOR = "stocks"
 TIMEOUT = 5
 # Default RAM Quota
 BUCKET_RAM_QUOTA = 1024
-
-
+# Couchbase SDK calls allowed in flight at once (each runs on its own thread)
+DB_CONCURRENCY = 16
+# Calls allowed to wait for a free slot before requests get a 503
+DB_MAX_PENDING = 1000
+# Price ingestion: "delta" reads only changed stock docs, "full" rescans every
+# tick, "board" reads the price board live_market.py --board writes
+PRICE_INGEST_MODE = "delta"
+# Seconds of CAS overlap re-read on each delta tick to allow for node clock skew
+PRICE_CURSOR_SKEW = 2
+# Force a full price rescan every N ticks to pick up anything the cursor missed
+PRICE_FULL_REFRESH_TICKS = 60
+# Stock leaderboard source: "memory" ranks price_data, "query" asks N1QL once a tick
+STOCK_LEADERBOARD_MODE = "memory"
+# Search backend: "local" searches the catalog in process, "fts" asks the FTS nodes
+SEARCH_BACKEND = "local"
+# Edit distance allowed between a search term and a word it matches
+SEARCH_FUZZINESS = 1
+# Most search results returned (FTS returns 10 hits by default)
+SEARCH_RESULT_LIMIT = 10
+# How many distinct searches to cache, and for how many seconds
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE_TTL = 30
+# Connections kept per FTS node (kept alive when pycurl is installed)
+FTS_POOL_SIZE = 10
+# Seconds before a single FTS request is abandoned
+FTS_TIMEOUT = 2
+# Weight of the newest sample in each FTS node's moving average latency
+FTS_EWMA_ALPHA = 0.2
+# Recent FTS latencies kept to work out the p95 hedging budget
+FTS_LATENCY_WINDOW = 200
+# Hedging budget in seconds until enough latencies have been seen
+FTS_HEDGE_DEFAULT = 0.1
+# Extra FTS nodes a slow or failed search may be sent to
+FTS_MAX_HEDGES = 1
+# Consecutive failures before an FTS node is evicted, and for how long
+FTS_MAX_FAILURES = 3
+FTS_EVICT_SECONDS = 30
+# Seconds between cluster status rounds (node status and ops counts)
+CB_STATUS_INTERVAL = 0.5
+# Seconds between full rounds that also recheck index, XDCR and FTS status
+CB_STATUS_SLOW_INTERVAL = 5
+# Seconds each long poll for cluster topology changes may wait
+CB_STATUS_LONG_POLL = 20
+# Connections kept to the management port
+CB_STATUS_POOL_SIZE = 4
+# Seconds between live orders ticks, and between leaderboard pushes
+ORDERS_TICK = 2
+LEADERBOARD_TICK = 5
+# Live orders each slow websocket client may fall behind by before the
+# oldest are dropped
+WS_ORDERS_QUEUE = 10
+# When a submitted order counts as accepted: "accepted" once queued for
+# writing, "persisted" once written or "majority" once replicated
+ORDER_DURABILITY = "persisted"
+# Most orders upserted in one batch, and the most waiting to be written
+ORDER_BATCH_SIZE = 100
+ORDER_QUEUE_SIZE = 10000
+# Batches of orders that may be written at once
+ORDER_WRITERS = 2
+# Price ticks per second from live_market.py
+MARKET_TICK_RATE = 1.0
+# Expected return per second, and the standard deviation of the return over
+# one second (about the old 2.5% every 8 seconds)
+MARKET_DRIFT = 0.0
+MARKET_VOLATILITY = 0.009
+# Batches of price updates live_market.py writes at once
+MARKET_CONCURRENCY = 8
+# Seconds between live_market.py throughput reports
+MARKET_REPORT_INTERVAL = 10
+# Documents per upsert batch when create_dataset.py loads data, and the
+# batches it writes at once
+LOAD_BATCH_SIZE = 500
+LOAD_CONCURRENCY = 8
+# Seconds between create_dataset.py progress reports
+LOAD_REPORT_INTERVAL = 5
+# Seconds between event loop lag checks, and how long the loop may be held
+# up before what's holding it is printed
+LOOP_LAG_INTERVAL = 0.1
+LOOP_LAG_THRESHOLD = 0.25
+# Seconds between profiler samples, the shortest interval /admin/profile may
+# ask for, and its longest run
+PROFILER_INTERVAL = 0.005
+PROFILER_MIN_INTERVAL = 0.001
+PROFILER_MAX_SECONDS = 120
+# Processes serving HTTP and websockets (0 for one per core). With more than
+# one, app.py runs a single ingester that polls the cluster for all of them
+WEB_PROCESSES = 1
+# Unix socket the ingester shares its snapshots with the web workers over
+WORKER_CHANNEL = "cbex.sock"
+# Address and port of the admin app: /metrics, /hubstats and /admin/profile,
+# served by the single process or the ingester. "" listens on every interface.
+ADMIN_ADDRESS = "127.0.0.1"
+ADMIN_PORT = 8081
+# Memory-mapped file holding the current price of every symbol, for any local
+# process to read. app.py writes it, unless PRICE_INGEST_MODE is "board", in
+# which case live_market.py --board does and app.py reads it.
+PRICE_BOARD_FILE = "price_board.bin"
+# Most symbols the price board holds
+PRICE_BOARD_CAPACITY = 16384
+# zlib level for permessage-deflate with the websocket clients that offer it
+# (None to turn it off). Each client's messages are compressed separately.
+WS_COMPRESSION_LEVEL = 1
+# Directory of the memory-mapped segment files holding each symbol's recent
+# prices, for /history
+PRICE_HISTORY_DIR = "price_history"
+# Price ticks of history kept per symbol, and symbols per segment file
+PRICE_HISTORY_CAPACITY = 4096
+PRICE_HISTORY_SEGMENT = 256
+# Scan consistency of the N1QL statements in queries.py that don't set their
+# own: "not_bounded" or "request_plus"
+QUERY_SCAN_CONSISTENCY = "not_bounded"
+# Orders read a page at a time while catching up with the orders already in
+# the bucket at startup, before the geo cache is warm
+ORDER_BACKFILL_PAGE = 5000
+# Orders kept in memory before older ones spill to ORDER_LOG_FILE
+ORDER_LOG_MEMORY_CAP = 100000
+# Memory-mapped file that spilled orders are written to
+ORDER_LOG_FILE = "order_log.bin"
@@ -0,0 +1,99 @@
+#!/usr/bin/env - python
+import json
+import time
+
+import pytest
+import tornado.gen
+import tornado.httpserver
+import tornado.ioloop
+import tornado.testing
+
+import fake_fts
+import fts_client
+import settings
+
+
+# Counts the connections made to it, to tell whether the client reuses them
+class CountingServer(tornado.httpserver.HTTPServer):
+    def initialize(self, *args, **kwargs):
+        super(CountingServer, self).initialize(*args, **kwargs)
+        self.connections = 0
+
+    def handle_stream(self, stream, address):
+        self.connections += 1
+        return super(CountingServer, self).handle_stream(stream, address)
+
+
+# Fake FTS nodes and a client, on an IOLoop of their own
+class Cluster(object):
+    def __init__(self):
+        with open(settings.STOCKS_FILE, "r") as stocks_json:
+            self.stocks = json.load(stocks_json)
+        self.io_loop = tornado.ioloop.IOLoop()
+        self.io_loop.make_current()
+        self.servers = []
+        self.client = fts_client.FTSClient()
+
+    # Starts a fake FTS node and returns its name
+    def start_node(self, delay=0.0, fail_rate=0.0):
+        sock, port = tornado.testing.bind_unused_port()
+        server = CountingServer(fake_fts.make_app(self.stocks, delay, fail_rate))
+        server.add_sockets([sock])
+        self.servers.append(server)
+        return "127.0.0.1:{}".format(port)
+
+    def search(self, text):
+        return self.io_loop.run_sync(lambda: self.client.search(text), timeout=5)
+
+    def close(self):
+        self.client.set_nodes([])
+        for server in self.servers:
+            server.stop()
+        # Let the servers finish with the connections they had open
+        self.io_loop.run_sync(lambda: tornado.gen.sleep(0.01))
+        self.io_loop.clear_current()
+        self.io_loop.close(all_fds=True)
+
+
+@pytest.fixture
+def cluster():
+    cluster = Cluster()
+    yield cluster
+    cluster.close()
+
+
+def test_search(cluster):
+    cluster.client.set_nodes([cluster.start_node()])
+    assert "stock:AAPL" in cluster.search("aple")
+
+
+def test_hedges_slow_node(cluster):
+    slow = cluster.start_node(delay=1.0)
+    fast = cluster.start_node()
+    cluster.client.set_nodes([slow, fast])
+    start = time.time()
+    assert "stock:MSFT" in cluster.search("microsoft")
+    # Answered by the hedge to the fast node, not the slow one
+    assert time.time() - start < 0.5
+    assert cluster.client.nodes[fast].latency is not None
+    assert cluster.client.nodes[slow].latency is None
+
+
+def test_evicts_failing_node(cluster):
+    failing = cluster.start_node(fail_rate=1.0)
+    healthy = cluster.start_node()
+    cluster.client.set_nodes([failing, healthy])
+    for _ in range(settings.FTS_MAX_FAILURES):
+        # The failing node has no latency yet, so it is always tried first
+        assert "stock:TSLA" in cluster.search("tesla")
+    assert cluster.client.nodes[failing].evicted_until > time.time()
+    assert cluster.client.candidates() == [cluster.client.nodes[healthy]]
+
+
+def test_reuses_connections(cluster):
+    # Only libcurl keeps connections alive
+    pytest.importorskip("pycurl")
+    cluster.client.set_nodes([cluster.start_node()])
+    for _ in range(10):
+        cluster.search("apple")
+    assert cluster.servers[0].connections == 1
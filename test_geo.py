@@ -0,0 +1,80 @@
+#!/usr/bin/env - python
+import time
+
+import create_dataset
+import geo
+import holdings
+import orders
+
+
+def make_aggregates(tmp_path, stocks, memory_cap=1000):
+    price_data = {
+        stock["symbol"]: {"price": stock["price"], "change": 0} for stock in stocks
+    }
+    log = orders.OrderLog(path=str(tmp_path / "order_log.bin"), memory_cap=memory_cap)
+    portfolio_holdings = holdings.Holdings(price_data, log)
+    return price_data, portfolio_holdings, geo.GeoAggregates(portfolio_holdings)
+
+
+def add_orders(portfolio_holdings, aggregates, count, stocks, seed=1):
+    docs = []
+    for i, (_, doc) in enumerate(create_dataset.synthetic_orders(count, stocks, seed)):
+        # Orders in other geos, or with "Unknown" spelt out, are left out
+        if i % 7 == 0:
+            doc["geo"] = "APAC" if i % 2 else "Unknown"
+        docs.append(doc)
+        aggregates.add(portfolio_holdings.add(doc))
+    return docs
+
+
+# What the cold-cache query and geo.group make of the same orders
+def expected(docs, price_data):
+    rows = [
+        {
+            "geo": doc.get("geo", geo.UNKNOWN),
+            "symbol": stock["symbol"],
+            "name": doc["name"],
+            "purchase_price": stock["purchase_price"],
+            "quantity": stock["quantity"],
+        }
+        for doc in docs
+        if doc.get("geo") in (None, "USA", "EU")
+        for stock in doc["order"]
+    ]
+    rows.sort(key=lambda row: row["symbol"])
+    return geo.group(rows, price_data)
+
+
+def test_matches_grouped_query(tmp_path):
+    stocks = list(create_dataset.synthetic_stocks(50, 1))
+    price_data, portfolio_holdings, aggregates = make_aggregates(tmp_path, stocks)
+    # Enough orders to spill part of the log to disk
+    docs = add_orders(portfolio_holdings, aggregates, 3000, stocks)
+    assert aggregates.geo_data() == expected(docs, price_data)
+
+    for stock in stocks[:10]:
+        price = stock["price"] * 1.5
+        price_data[stock["symbol"]] = {"price": price, "change": 50}
+        portfolio_holdings.set_price(stock["symbol"], price)
+    got = aggregates.geo_data()
+    want = expected(docs, price_data)
+    for name in geo.GEOS:
+        assert abs(got[name]["total"] - want[name]["total"]) < 0.05
+        assert got[name]["investments"] == want[name]["investments"]
+
+
+def test_ingest_at_scale(tmp_path):
+    stocks = list(create_dataset.synthetic_stocks(1000, 1))
+    _, portfolio_holdings, aggregates = make_aggregates(tmp_path, stocks, 100000)
+    docs = list(create_dataset.synthetic_orders(200000, stocks, 1))
+    start = time.time()
+    for _, doc in docs:
+        aggregates.add(portfolio_holdings.add(doc))
+    # Linear in the number of orders: adding them one by one into sorted
+    # lists took over a minute
+    assert time.time() - start < 20
+    assert sum(aggregates.counts) == 5 * len(docs)
+    start = time.time()
+    geo_data = aggregates.geo_data()
+    assert time.time() - start < 20
+    assert sum(len(data["investments"]) for data in geo_data.values()) == 5 * len(docs)
@@ -0,0 +1,19 @@
+#!/usr/bin/env - python
+import orders
+
+
+def test_many_geos(tmp_path):
+    log = orders.OrderLog(path=str(tmp_path / "order_log.bin"), memory_cap=64)
+    for i in range(300):
+        log.append(
+            {
+                "name": "investor",
+                "geo": "geo{}".format(i),
+                "ts": i,
+                "order": [{"symbol": "AAA", "purchase_price": 1.0, "quantity": 2.0}],
+            }
+        )
+    # Including the ones spilled to the file
+    assert [log.order(i)["geo"] for i in range(300)] == [
+        "geo{}".format(i) for i in range(300)
+    ]
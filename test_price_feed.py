@@ -0,0 +1,58 @@
+#!/usr/bin/env - python
+import fake_cluster
+import price_feed
+
+
+def make_feed(skew):
+    cluster = fake_cluster.FakeCluster()
+    collection = cluster.bucket("cbex").default_collection()
+    for symbol, price in (("AAA", 10.0), ("BBB", 20.0), ("CCC", 30.0)):
+        collection.upsert(
+            symbol, {"symbol": symbol, "price": price, "starting_price": price}
+        )
+    collection.upsert("order1", {"type": "order", "ts": 1, "order": []})
+    feed = price_feed.N1QLPriceFeed(cluster)
+    # The in-memory cluster numbers mutations 1, 2, 3..., so the skew window
+    # is set in CAS units rather than seconds
+    feed.skew = skew
+    return collection, feed
+
+
+def symbols(rows):
+    return sorted(row["symbol"] for row in rows)
+
+
+def test_first_read_returns_every_stock():
+    _, feed = make_feed(0)
+    rows, cursor = feed.changes()
+    assert symbols(rows) == ["AAA", "BBB", "CCC"]
+    assert cursor == max(row["cas"] for row in rows)
+
+
+def test_cursor_only_returns_changes():
+    collection, feed = make_feed(0)
+    _, cursor = feed.changes()
+    rows, unchanged = feed.changes(cursor)
+    assert rows == []
+    assert unchanged == cursor
+    collection.upsert("BBB", {"symbol": "BBB", "price": 21.0, "starting_price": 20.0})
+    rows, moved = feed.changes(cursor)
+    assert symbols(rows) == ["BBB"]
+    assert rows[0]["price"] == 21.0
+    assert moved == rows[0]["cas"] > cursor
+
+
+def test_skew_window_reads_recent_changes_again():
+    collection, feed = make_feed(2)
+    _, cursor = feed.changes()
+    collection.upsert("AAA", {"symbol": "AAA", "price": 11.0, "starting_price": 10.0})
+    collection.upsert("CCC", {"symbol": "CCC", "price": 31.0, "starting_price": 30.0})
+    # BBB (CAS 2) was written within the window of the cursor (CAS 3), so it
+    # is read again along with the two changes
+    rows, cursor = feed.changes(cursor)
+    assert symbols(rows) == ["AAA", "BBB", "CCC"]
+    # Nothing has changed since, but the two stocks within the window of the
+    # cursor are read again, and the cursor never moves back
+    rows, again = feed.changes(cursor)
+    assert symbols(rows) == ["AAA", "CCC"]
+    assert again == cursor
@@ -0,0 +1,51 @@
+#!/usr/bin/env - python
+import json
+import random
+
+import search
+import settings
+
+
+def load_index():
+    with open(settings.STOCKS_FILE, "r") as stocks_json:
+        stocks = json.load(stocks_json)
+    index = search.SearchIndex()
+    index.build({stock["symbol"]: stock for stock in stocks})
+    return index
+
+
+# Every word with one character deleted, replaced or inserted
+def one_edit_probes(vocabulary, count, seed=0):
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    probes = []
+    for _ in range(count):
+        word = rng.choice(vocabulary)
+        i = rng.randrange(len(word) + 1)
+        edit = rng.choice(("delete", "replace", "insert"))
+        if edit == "delete" and i < len(word):
+            probes.append(word[:i] + word[i + 1 :])
+        elif edit == "replace" and i < len(word):
+            probes.append(word[:i] + rng.choice(letters) + word[i + 1 :])
+        else:
+            probes.append(word[:i] + rng.choice(letters) + word[i:])
+    return probes
+
+
+def test_find_matches_brute_force():
+    index = load_index()
+    probes = one_edit_probes(index.vocabulary, 500)
+    for limit in (1, 2):
+        for probe in probes:
+            expected = {
+                word
+                for word in index.vocabulary
+                if search.distance(probe, word, limit) <= limit
+            }
+            assert set(index.tree.find(probe, limit)) == expected, probe
+
+
+def test_search_with_typos():
+    index = load_index()
+    assert "AAPL" in index.search("aple")
+    assert "MSFT" in index.search("microsft")
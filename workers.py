@@ -0,0 +1,133 @@
+#!/usr/bin/env - python
+# Multi-process serving. One ingester process polls the cluster, as a single
+# process app.py would, and shares what it works out with web worker
+# processes over a Unix socket: each worker is subscribed to the ingester's
+# hub topics, and sends the orders it accepts back to the ingester. Workers
+# share the web port with SO_REUSEPORT.
+
+import socket
+import subprocess
+
+import tornado.gen
+import tornado.ioloop
+import tornado.iostream
+import tornado.netutil
+import tornado.tcpserver
+import tornado.websocket
+
+
+# Every message on a channel is "<name> <length>\n" followed by the payload
+def frame(name, payload):
+    return "{} {}\n".format(name, len(payload)).encode() + payload
+
+
+@tornado.gen.coroutine
+def read_frame(stream):
+    header = yield stream.read_until(b"\n")
+    name, length = header.decode().split()
+    payload = yield stream.read_bytes(int(length))
+    raise tornado.gen.Return((name, payload))
+
+
+# Stands in for a websocket so a worker can subscribe to one of the ingester's
+# topics. Messages are written to the worker's channel tagged with the topic
+# name, with the same backpressure a slow websocket client gets.
+class Relay(object):
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.name = name
+
+    def write_message(self, payload):
+        try:
+            return self.stream.write(frame(self.name, payload))
+        except tornado.iostream.StreamClosedError:
+            raise tornado.websocket.WebSocketClosedError()
+
+
+# The ingester's end: every worker that connects is subscribed to `topics`,
+# and whatever it sends back is passed to on_message(name, payload)
+class ChannelServer(tornado.tcpserver.TCPServer):
+    def __init__(self, hub, topics, on_message):
+        super(ChannelServer, self).__init__()
+        self.hub = hub
+        self.topics = topics
+        self.on_message = on_message
+        self.workers = 0
+
+    def listen_unix(self, path):
+        self.add_socket(tornado.netutil.bind_unix_socket(path))
+
+    @tornado.gen.coroutine
+    def handle_stream(self, stream, address):
+        self.workers += 1
+        relays = [(self.hub[name], Relay(stream, name)) for name in self.topics]
+        for topic, relay in relays:
+            topic.subscribe(relay)
+        try:
+            while True:
+                name, payload = yield read_frame(stream)
+                self.on_message(name, payload)
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            self.workers -= 1
+            for topic, relay in relays:
+                topic.unsubscribe(relay)
+
+
+# A worker's end. There is nothing useful a worker can do without the
+# ingester, so it stops the IOLoop (and so exits) when the channel closes.
+class Channel(object):
+    def __init__(self, path, on_message):
+        self.path = path
+        self.on_message = on_message
+        self.stream = None
+
+    @tornado.gen.coroutine
+    def connect(self):
+        self.stream = tornado.iostream.IOStream(
+            socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        )
+        yield self.stream.connect(self.path)
+
+    @tornado.gen.coroutine
+    def run(self):
+        try:
+            while True:
+                name, payload = yield read_frame(self.stream)
+                self.on_message(name, payload)
+        except tornado.iostream.StreamClosedError:
+            print("Lost the ingester, exiting")
+            tornado.ioloop.IOLoop.current().stop()
+
+    def send(self, name, payload):
+        return self.stream.write(frame(name, payload))
+
+
+# Starts `count` copies of `command` and starts them again if they exit
+class Supervisor(object):
+    def __init__(self, command, count):
+        self.command = command
+        self.count = count
+        self.processes = []
+        self.timer = None
+
+    def start(self):
+        self.processes = [subprocess.Popen(self.command) for _ in range(self.count)]
+        self.timer = tornado.ioloop.PeriodicCallback(self.check, 1000)
+        self.timer.start()
+
+    def check(self):
+        for i, process in enumerate(self.processes):
+            code = process.poll()
+            if code is not None:
+                print(
+                    ("Worker {} exited with {}, restarting").format(process.pid, code)
+                )
+                self.processes[i] = subprocess.Popen(self.command)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.stop()
+        for process in self.processes:
+            process.terminate()
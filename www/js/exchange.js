@@ -195,7 +195,7 @@ window.onload = function ExchangePageWebSockets() {
 
         nodes_ws.onmessage = function (evt) {
             var msg = JSON.parse(evt.data);
-            if (msg['fts']) {
+            if (msg['search']) {
                 $(".search-container").show();
             } else {
                 $(".search-container").hide();
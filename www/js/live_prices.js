@@ -11,7 +11,7 @@ $(document).ready(function () {
     };
 
     prices_ws.onmessage = function (evt) {
-        var msg = JSON.parse(evt.data);
+        var msg = JSON.parse(evt.data)['prices'];
         for (var symbol in msg) {
             if (msg.hasOwnProperty(symbol))  // SO says do this
             {